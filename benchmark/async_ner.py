@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+"""
+Throughput of AsyncNER under concurrent calls exceeding its queue limit,
+with check that results equal getPredictedNER.predict_batch output.
+"""
+
+
+import argparse
+import asyncio
+import json
+import time
+
+from utils.async_ner import AsyncNER
+from utils.inference import add_model_arguments, load_ner_from_args
+from utils.text import read_txt_file
+
+
+async def run_clients(async_ner, texts, concurrency):
+    """
+    Tag texts with concurrency apredict calls at once (waiting for queue
+    capacity if it is exceeded). Return outputs and wall time.
+    """
+    
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def tag(text):
+        async with semaphore:
+            return await async_ner.apredict(text)
+    
+    start = time.perf_counter()
+    outputs = await asyncio.gather(*(tag(text) for text in texts))
+    
+    return outputs, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    
+    parser = argparse.ArgumentParser(
+        description='Check AsyncNER with more concurrent calls than queue '
+        'capacity.')
+    parser.add_argument('--data', default='data/conll2003/test.txt',
+                        help='CoNLL file with sentences to tag')
+    parser.add_argument('--texts', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=256,
+                        help='number of concurrent apredict calls')
+    parser.add_argument('--max-pending', type=int, default=32,
+                        help='queue capacity of AsyncNER (below concurrency '
+                        'so that calls wait for capacity)')
+    parser.add_argument('--runs', type=int, default=2,
+                        help='number of asyncio.run event loops')
+    add_model_arguments(parser)
+    args = parser.parse_args()
+    
+    sentences, _ = read_txt_file(args.data)
+    texts = [' '.join(words) for words in sentences[:args.texts]]
+    
+    get_ner = load_ner_from_args(args)
+    expected = get_ner.predict_batch(texts)
+    
+    # created before (and shared by) event loops, as usual in applications
+    async_ner = AsyncNER(get_ner, args.batch_size,
+                         max_pending=args.max_pending, overload='wait')
+    
+    timings, mismatches = [], 0
+    for _ in range(args.runs):
+        outputs, seconds = asyncio.run(
+            run_clients(async_ner, texts, args.concurrency))
+        timings.append(seconds)
+        mismatches += sum(out != exp for out, exp in zip(outputs, expected))
+    async_ner.batcher.close()
+    
+    result = {
+        'texts': len(texts),
+        'concurrency': args.concurrency,
+        'max_pending': args.max_pending,
+        'mismatches': mismatches,
+        'texts_per_sec': len(texts) / min(timings),
+        **async_ner.stats(),
+        }
+    print(json.dumps(result, indent=4))
+    
+    if mismatches:
+        raise SystemExit(f'{mismatches} outputs differ from predict_batch.')
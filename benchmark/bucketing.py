@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+"""
+Throughput of length-bucketed and per-batch trimmed versus fully padded
+prediction.
+"""
+
+
+import argparse
+import json
+import os
+import time
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+
+import joblib
+import numpy as np
+import tensorflow as tf
+
+from model_tf.model_tuner import (TracedPredictModel, 
+                                  get_dynamic_length_model)
+from utils.batching import predict_in_batches
+from utils.text import read_txt_file
+
+
+def time_predict(model, X, batch_size, buckets, repeats, trim=False):
+    """Return best wall time of repeats runs and predicted label ids."""
+    predict_in_batches(model, X, batch_size, buckets, trim)
+    
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        pred = predict_in_batches(model, X, batch_size, buckets, trim)
+        timings.append(time.perf_counter() - start)
+    
+    return min(timings), np.argmax(pred, axis=-1)
+
+
+if __name__ == '__main__':
+    
+    parser = argparse.ArgumentParser(
+        description='Compare padded, length-bucketed and trimmed '
+        'prediction.')
+    parser.add_argument('--data', default='data/conll2003/test.txt',
+                        help='CoNLL file with sentences to predict')
+    parser.add_argument('--model', default='inference/h5_model/model.h5',
+                        help='Keras model in h5 format')
+    parser.add_argument('--buckets', type=int, nargs='+', 
+                        default=[16, 32, 64], help='bucket sequence lengths')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+    
+    sentences, _ = read_txt_file(args.data)
+    tokenizer = joblib.load('inference/tokenizer.joblib')
+    X = tokenizer.transform(sentences)
+    lengths = X[-1].sum(axis=1)
+    
+    model = TracedPredictModel(get_dynamic_length_model(
+        tf.keras.models.load_model(args.model)))
+    
+    padded_time, padded_ids = time_predict(
+        model, X, args.batch_size, None, args.repeats)
+    bucketed_time, bucketed_ids = time_predict(
+        model, X, args.batch_size, args.buckets, args.repeats)
+    trimmed_time, trimmed_ids = time_predict(
+        model, X, args.batch_size, None, args.repeats, trim=True)
+    
+    mask = X[-1].astype(bool)
+    result = {
+        'sentences': len(sentences),
+        'mean_length': float(lengths.mean()),
+        'buckets': args.buckets,
+        'batch_size': args.batch_size,
+        'padded_sent_per_sec': len(sentences) / padded_time,
+        'bucketed_sent_per_sec': len(sentences) / bucketed_time,
+        'trimmed_sent_per_sec': len(sentences) / trimmed_time,
+        'speedup': padded_time / bucketed_time,
+        'trimmed_speedup': padded_time / trimmed_time,
+        'label_agreement': float(
+            (padded_ids[mask] == bucketed_ids[mask]).mean()),
+        'trimmed_label_agreement': float(
+            (padded_ids[mask] == trimmed_ids[mask]).mean()),
+        }
+    print(json.dumps(result, indent=4))
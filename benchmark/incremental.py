@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+"""
+Re-tag latency of edited document with IncrementalNER versus tagging the
+whole document with getPredictedNER.
+"""
+
+
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+
+from utils.incremental import IncrementalNER, split_sentences
+from utils.inference import add_model_arguments, load_ner_from_args
+from utils.text import read_txt_file
+
+
+def get_edits(document, n_edits, seed=0):
+    """
+    Versions of document after each of n_edits consecutive edits, every
+    one replacing a random word of a random sentence, as while typing.
+    """
+    
+    rng = random.Random(seed)
+    sentences = [sentence.split(' ')
+                 for sentence in split_sentences(document)]
+    versions = []
+    for _ in range(n_edits):
+        words = rng.choice(sentences)
+        words[rng.randrange(len(words))] = rng.choice(['Paris', 'said',
+                                                       'Smith', 'the'])
+        versions.append('\n'.join(' '.join(words) for words in sentences))
+    
+    return versions
+
+
+def time_retag(tag, versions):
+    """Return latencies of tagging consecutive versions of document."""
+    latencies = []
+    for version in versions:
+        start = time.perf_counter()
+        tag(version)
+        latencies.append(time.perf_counter() - start)
+    
+    return np.asarray(latencies)
+
+
+if __name__ == '__main__':
+    
+    parser = argparse.ArgumentParser(
+        description='Compare full and incremental re-tagging of edited '
+        'document.')
+    parser.add_argument('--data', default='data/conll2003/test.txt',
+                        help='CoNLL file with sentences for document')
+    parser.add_argument('--sentences', type=int, default=50,
+                        help='number of sentences in document')
+    parser.add_argument('--edits', type=int, default=100)
+    parser.add_argument('--incremental-cache', type=int, default=4096,
+                        help='number of sentences kept in cache')
+    parser.add_argument('--seed', type=int, default=0)
+    add_model_arguments(parser)
+    args = parser.parse_args()
+    
+    sentences, _ = read_txt_file(args.data)
+    document = '\n'.join(' '.join(words)
+                         for words in sentences[:args.sentences])
+    versions = get_edits(document, args.edits, args.seed)
+    
+    # whole document is tagged with windows instead of being truncated
+    get_ner = load_ner_from_args(args)
+    get_ner.windowed = True
+    incremental_ner = IncrementalNER(get_ner, args.incremental_cache)
+    
+    # warm up model and fill cache with original document
+    get_ner(document)
+    incremental_ner(document)
+    
+    full = time_retag(get_ner, versions)
+    incremental = time_retag(incremental_ner, versions)
+    
+    result = {
+        'sentences': args.sentences,
+        'edits': args.edits,
+        'full_ms_p50': float(np.median(full) * 1e3),
+        'incremental_ms_p50': float(np.median(incremental) * 1e3),
+        'full_ms_p99': float(np.percentile(full, 99) * 1e3),
+        'incremental_ms_p99': float(np.percentile(incremental, 99) * 1e3),
+        'speedup': float(full.sum() / incremental.sum()),
+        **incremental_ner.stats(),
+        }
+    print(json.dumps(result, indent=4))
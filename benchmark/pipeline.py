@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+"""Per-stage timing of end-to-end NER pipeline with regression check."""
+
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from collections import OrderedDict
+
+import joblib
+import numpy as np
+
+from utils.batching import predict_in_batches
+from utils.encoders import indices_to_labels
+from utils.inference import add_model_arguments, load_ner_from_args
+from utils.text import read_txt_file
+
+
+STAGES = ('preprocess', 'tokenize', 'predict', 'decode',
+          'indices_to_labels')
+
+
+def get_documents(sentences, doc_length, n_docs):
+    """
+    Create n_docs documents of doc_length tokens by joining consecutive
+    sentences (cycling over them if needed).
+    """
+    
+    documents, tokens, i = [], [], 0
+    while len(documents) < n_docs:
+        tokens.extend(sentences[i % len(sentences)])
+        i += 1
+        if len(tokens) >= doc_length:
+            documents.append(' '.join(tokens[:doc_length]))
+            tokens = []
+    
+    return documents
+
+
+def time_stages(get_ner, label_encoder, documents, batch_size):
+    """
+    Run pipeline stages of getPredictedNER on documents in batches of
+    batch_size and return total wall time of each stage.
+    """
+    
+    timings = dict.fromkeys(STAGES, 0.0)
+    tokenizer = get_ner.tokenizer
+    
+    for i in range(0, len(documents), batch_size):
+        batch = documents[i:i + batch_size]
+        
+        start = time.perf_counter()
+        texts = get_ner.preprocessor(batch)
+        timings['preprocess'] += time.perf_counter() - start
+        
+        start = time.perf_counter()
+        rows = [tokenizer.get_original_tokens(text) for text in texts]
+        input_X = tokenizer.transform(rows)
+        timings['tokenize'] += time.perf_counter() - start
+        
+        start = time.perf_counter()
+        pred = predict_in_batches(get_ner.model, input_X, batch_size,
+                                  get_ner.buckets, get_ner.trim)
+        timings['predict'] += time.perf_counter() - start
+        
+        start = time.perf_counter()
+        input_mask = input_X[-1].astype(bool)
+        pred_ids = np.argmax(pred, axis=-1)
+        get_ner.decode_rows(pred_ids, input_mask)
+        timings['decode'] += time.perf_counter() - start
+        
+        start = time.perf_counter()
+        indices_to_labels(label_encoder, pred_ids, input_mask)
+        timings['indices_to_labels'] += time.perf_counter() - start
+    
+    return timings
+
+
+def run_benchmark(get_ner, label_encoder, sources, doc_lengths,
+                  batch_sizes, n_docs=256, repeats=3):
+    """
+    Time pipeline stages for every source (name: list of token lists),
+    document length and batch size. Best of repeats runs is reported
+    for each stage.
+    """
+    
+    # warm up model (graph tracing, memory allocation)
+    get_ner.predict_batch(['Warm up .'] * max(batch_sizes))
+    
+    results = []
+    for source, sentences in sources.items():
+        for doc_length in doc_lengths:
+            documents = get_documents(sentences, doc_length, n_docs)
+            for batch_size in batch_sizes:
+                runs = [time_stages(get_ner, label_encoder, documents,
+                                    batch_size) for _ in range(repeats)]
+                n_batches = -(-len(documents) // batch_size)
+                
+                stages = OrderedDict()
+                for stage in STAGES:
+                    seconds = min(run[stage] for run in runs)
+                    stages[stage] = {
+                        'seconds': seconds,
+                        'ms_per_batch': seconds / n_batches * 1000,
+                        'docs_per_sec': len(documents) / max(seconds, 1e-9)}
+                total = sum(stage['seconds'] for stage in stages.values())
+                stages['total'] = {
+                    'seconds': total,
+                    'ms_per_batch': total / n_batches * 1000,
+                    'docs_per_sec': len(documents) / max(total, 1e-9)}
+                
+                results.append({'source': source, 'doc_length': doc_length,
+                                'batch_size': batch_size,
+                                'documents': len(documents),
+                                'stages': stages})
+    
+    return results
+
+
+def compare_results(baseline, current, tolerance=0.1, min_seconds=1e-3):
+    """
+    Compare stage timings of two benchmark runs matched by source,
+    document length and batch size. Stage is flagged as regression if
+    it got slower by more than tolerance (relative) and takes at least
+    min_seconds. Returns list of comparisons and list of regressions.
+    """
+    
+    def key(result):
+        return result['source'], result['doc_length'], result['batch_size']
+    
+    baseline = {key(result): result for result in baseline['results']}
+    
+    comparisons, regressions = [], []
+    for result in current['results']:
+        if key(result) not in baseline:
+            continue
+        old_stages = baseline[key(result)]['stages']
+        for stage, timing in result['stages'].items():
+            if stage not in old_stages:
+                continue
+            old, new = old_stages[stage]['seconds'], timing['seconds']
+            comparison = {'source': result['source'],
+                          'doc_length': result['doc_length'],
+                          'batch_size': result['batch_size'],
+                          'stage': stage, 'baseline_seconds': old,
+                          'current_seconds': new,
+                          'ratio': new / max(old, 1e-9)}
+            comparison['regression'] = (
+                comparison['ratio'] > 1 + tolerance
+                and new >= min_seconds)
+            comparisons.append(comparison)
+            if comparison['regression']:
+                regressions.append(comparison)
+    
+    return comparisons, regressions
+
+
+def format_comparisons(comparisons):
+    """Format comparisons from compare_results as text table."""
+    lines = ['{:<8} {:>6} {:>6} {:<18} {:>10} {:>10} {:>7}'.format(
+        'source', 'length', 'batch', 'stage', 'base [s]', 'curr [s]',
+        'ratio')]
+    for c in comparisons:
+        lines.append('{:<8} {:>6} {:>6} {:<18} {:>10.4f} {:>10.4f} '
+                     '{:>7.2f}{}'.format(
+                         c['source'], c['doc_length'], c['batch_size'],
+                         c['stage'], c['baseline_seconds'],
+                         c['current_seconds'], c['ratio'],
+                         '  REGRESSION' if c['regression'] else ''))
+    
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    
+    parser = argparse.ArgumentParser(
+        description='Benchmark NER pipeline stages or compare two runs.')
+    parser.add_argument('--output', default=None,
+                        help='JSON file for results (printed if not set)')
+    parser.add_argument('--data', default='data/conll2003/test.txt',
+                        help='CoNLL file with sentences for documents')
+    parser.add_argument('--sample', default='data/sample.txt',
+                        help='txt file used as second document source')
+    parser.add_argument('--doc-lengths', type=int, nargs='+',
+                        default=[8, 32, 64, 128],
+                        help='document lengths in tokens')
+    parser.add_argument('--batch-sizes', type=int, nargs='+',
+                        default=[1, 8, 64], help='batch sizes')
+    parser.add_argument('--docs', type=int, default=256,
+                        help='number of documents per configuration')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'),
+                        help='compare two JSON results and flag regressions')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='relative slowdown flagged as regression')
+    parser.add_argument('--min-seconds', type=float, default=1e-3,
+                        help='ignore stages faster than this')
+    add_model_arguments(parser)
+    args = parser.parse_args()
+    
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        comparisons, regressions = compare_results(
+            baseline, current, args.tolerance, args.min_seconds)
+        print(format_comparisons(comparisons))
+        print('\n{} regression(s) found.'.format(len(regressions)))
+        sys.exit(1 if regressions else 0)
+    
+    sentences, _ = read_txt_file(args.data)
+    with open(args.sample) as sample_file:
+        sample = sample_file.read().split()
+    sources = {'conll': sentences, 'sample': [sample]}
+    
+    get_ner = load_ner_from_args(args)
+    label_encoder = joblib.load(os.path.join(args.directory,
+                                             'label_encoder.joblib'))
+    
+    results = run_benchmark(get_ner, label_encoder, sources,
+                            args.doc_lengths, args.batch_sizes,
+                            args.docs, args.repeats)
+    output = {'meta': {'engine': args.engine, 'buckets': args.buckets,
+                       'cache_size': args.cache_size,
+                       'python': platform.python_version(),
+                       'numpy': np.__version__,
+                       'platform': platform.platform()},
+              'results': results}
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=4)
+    else:
+        print(json.dumps(output, indent=4))
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+"""
+Throughput of compiled versus reference TextPreprocessor with randomized
+check that both produce identical output.
+"""
+
+
+import argparse
+import json
+import random
+import time
+
+from utils.text import DEFAULT_PUNCTUATION, TextPreprocessor, read_txt_file
+
+
+# characters exercising all branches of preprocessing patterns: letters
+# matched by case insensitive [a-z] (incl. Kelvin sign and long s),
+# apostrophe suffixes, punctuation and various whitespace
+ALPHABET = ("aAsSlLmMrReEvVdDnNtTKſé1'" + DEFAULT_PUNCTUATION +
+            "  \t\n\x1f ")
+
+
+def get_random_texts(n_texts, max_length, seed=0):
+    """Random texts of up to max_length characters drawn from ALPHABET."""
+    rng = random.Random(seed)
+    return [''.join(rng.choice(ALPHABET)
+                    for _ in range(rng.randint(0, max_length)))
+            for _ in range(n_texts)]
+
+
+def get_mismatches(preprocessor, texts):
+    """
+    Texts for which compiled preprocessing of single text or batch differs
+    from reference implementation.
+    """
+    
+    expected = preprocessor(texts, fast=False)
+    batch = preprocessor(texts)
+    
+    return [text for text, exp, out in zip(texts, expected, batch)
+            if out != exp or preprocessor(text) != exp]
+
+
+def time_preprocess(preprocessor, texts, fast, repeats):
+    """Return best wall time of repeats runs."""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        preprocessor(texts, fast=fast)
+        timings.append(time.perf_counter() - start)
+    
+    return min(timings)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Compare compiled and reference TextPreprocessor.')
+    parser.add_argument('--data', default='data/conll2003/test.txt',
+                        help='CoNLL file with sentences to preprocess')
+    parser.add_argument('--random-texts', type=int, default=100000,
+                        help='number of random texts to check')
+    parser.add_argument('--max-length', type=int, default=16,
+                        help='maximum length of random texts')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    
+    sentences, _ = read_txt_file(args.data)
+    texts = [' '.join(words) for words in sentences]
+    random_texts = get_random_texts(args.random_texts, args.max_length,
+                                    args.seed)
+    
+    mismatches = []
+    for settings in [(True, True), (True, False), (False, True)]:
+        preprocessor = TextPreprocessor(*settings)
+        mismatches.extend(get_mismatches(preprocessor, random_texts))
+        mismatches.extend(get_mismatches(preprocessor, texts))
+    
+    preprocessor = TextPreprocessor()
+    reference_time = time_preprocess(preprocessor, texts, False,
+                                     args.repeats)
+    compiled_time = time_preprocess(preprocessor, texts, True,
+                                    args.repeats)
+    
+    result = {
+        'texts': len(texts),
+        'random_texts': len(random_texts),
+        'mismatches': len(mismatches),
+        'reference_mb_per_sec':
+            sum(map(len, texts)) / reference_time / 1e6,
+        'compiled_mb_per_sec':
+            sum(map(len, texts)) / compiled_time / 1e6,
+        'speedup': reference_time / compiled_time,
+        }
+    print(json.dumps(result, indent=4))
+    
+    if mismatches:
+        raise SystemExit('Output differs for: {!r}'.format(mismatches[:10]))
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+"""Size, load time, latency and F1 of quantized model variants."""
+
+
+import argparse
+import json
+import os
+import time
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+
+import joblib
+import numpy as np
+import tensorflow as tf
+
+from evaluation.conlleval import get_chunk_scores
+from utils.numpy_model import QUANTIZATIONS, NumpyNERModel
+from utils.text import read_txt_file
+
+
+def get_size(path):
+    """Size in bytes of file or all files in directory."""
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, name))
+                   for name in os.listdir(path))
+    return os.path.getsize(path)
+
+
+def load_tfjs_model(path):
+    """Load Keras model from tfjs directory (weights are dequantized)."""
+    import tensorflowjs as tfjs
+    return tfjs.converters.load_keras_model(
+        os.path.join(path, 'model.json'))
+
+
+def get_variants(inference_dir='inference', tfjs_dir='web-app/tfjs_model'):
+    """
+    List of (format, quantization, loader, path) for float32 models and
+    their float16 and int8 variants saved by model_tf.model_tuner.
+    """
+    
+    variants = [
+        ('h5', 'float32', tf.keras.models.load_model,
+         os.path.join(inference_dir, 'h5_model', 'model.h5')),
+        ('npz', 'float32', NumpyNERModel.from_npz,
+         os.path.join(inference_dir, 'model.npz')),
+        ('tfjs', 'float32', load_tfjs_model, tfjs_dir),
+        ]
+    for quantization in QUANTIZATIONS:
+        variants.append(('npz', quantization, NumpyNERModel.from_npz,
+                         os.path.join(inference_dir,
+                                      f'model_{quantization}.npz')))
+        variants.append(('tfjs', quantization, load_tfjs_model,
+                         f'{tfjs_dir}_{quantization}'))
+    
+    return variants
+
+
+def measure_variant(load, path, X, true_ids, mask, classes, batch_size=64):
+    """
+    Load time, median per-batch latency and chunk F1 on (X, true_ids)
+    of model loaded from path with load.
+    """
+    
+    start = time.perf_counter()
+    model = load(path)
+    load_time = time.perf_counter() - start
+    
+    batches = [[x[i:i + batch_size] for x in X]
+               for i in range(0, len(X[0]), batch_size)]
+    model.predict_on_batch(batches[0])
+    
+    latencies, pred_ids = [], []
+    for batch in batches:
+        start = time.perf_counter()
+        pred = model.predict_on_batch(batch)
+        latencies.append(time.perf_counter() - start)
+        pred_ids.append(np.argmax(pred, axis=-1))
+    
+    scores = get_chunk_scores(true_ids, np.concatenate(pred_ids), mask,
+                              classes)
+    
+    return {'size_mb': get_size(path) / 2 ** 20,
+            'load_sec': load_time,
+            'batch_latency_ms': float(np.median(latencies)) * 1000,
+            'f1': scores['f1']}
+
+
+def get_quantization_report(variants, X, true_ids, mask, classes,
+                            batch_size=64):
+    """
+    Measure existing variants (see get_variants) and compare each one
+    with float32 model of the same format.
+    """
+    
+    report = []
+    for fmt, quantization, load, path in variants:
+        if not os.path.exists(path):
+            continue
+        result = {'format': fmt, 'quantization': quantization,
+                  'path': path}
+        result.update(measure_variant(load, path, X, true_ids, mask,
+                                      classes, batch_size))
+        report.append(result)
+    
+    baselines = {result['format']: result for result in report
+                 if result['quantization'] == 'float32'}
+    for result in report:
+        baseline = baselines.get(result['format'])
+        if baseline:
+            result['size_ratio'] = result['size_mb'] / baseline['size_mb']
+            result['f1_delta'] = result['f1'] - baseline['f1']
+    
+    return report
+
+
+def get_eval_data(path, tokenizer, label_encoder):
+    """Model input, true label ids and mask for sentences in CoNLL file."""
+    
+    sentences, labels = read_txt_file(path)
+    X = tokenizer.transform(sentences)
+    mask = X[-1].astype(bool)
+    true_labels = [label for labels_per_sentence, n_tokens
+                   in zip(labels, mask.sum(axis=1))
+                   for label in labels_per_sentence[:n_tokens]]
+    true_ids = np.zeros(mask.shape, dtype=int)
+    true_ids[mask] = label_encoder.transform(true_labels)
+    
+    return X, true_ids, mask
+
+
+if __name__ == '__main__':
+    
+    parser = argparse.ArgumentParser(
+        description='Compare float32 and quantized model variants.')
+    parser.add_argument('--data', default='data/conll2003/test.txt',
+                        help='CoNLL file used for latency and F1')
+    parser.add_argument('--directory', default='inference',
+                        help='directory with h5 model and npz files')
+    parser.add_argument('--tfjs', default='web-app/tfjs_model',
+                        help='float32 tfjs model directory (quantized '
+                        'variants have _float16 and _int8 suffix)')
+    parser.add_argument('--batch-size', type=int, default=64)
+    args = parser.parse_args()
+    
+    tokenizer = joblib.load(os.path.join(args.directory,
+                                         'tokenizer.joblib'))
+    label_encoder = joblib.load(os.path.join(args.directory,
+                                             'label_encoder.joblib'))
+    X, true_ids, mask = get_eval_data(args.data, tokenizer, label_encoder)
+    
+    report = get_quantization_report(
+        get_variants(args.directory, args.tfjs), X, true_ids, mask,
+        label_encoder.classes_, args.batch_size)
+    print(json.dumps(report, indent=4))
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+"""
+Throughput of compiled versus Keras CustomTokenizer.transform with check
+that both produce identical arrays on CoNLL sentences.
+"""
+
+
+import argparse
+import json
+import os
+import random
+import time
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+
+import joblib
+import numpy as np
+
+from utils.text import CustomTokenizer, read_txt_file
+
+
+# tokenizer settings covering compiled transform and its fallbacks:
+# filters splitting words differently than characters, upper case filters
+# and non-space whitespace (word ids not shared with token cache), cased
+# words, no character level and no OOV token (Keras transform used)
+SETTINGS = {
+    'default': {},
+    'filters': {'filters': '!"#$%&()*+,-./:;<=>?@[\\]^_`{|}~\t\n'},
+    'upper_filters': {'filters': '.,E'},
+    'cased': {'lower': False},
+    'word_level': {'char_level': False},
+    'no_oov': {'oov_token': None},
+    }
+
+WHITESPACE = (' ', ' ', ' ', '  ', '\t', '\n', '\xa0')
+
+
+def get_inputs(sentences, seed=0):
+    """
+    Token lists, texts joined with spaces and texts joined with random
+    whitespace for sentences.
+    """
+    
+    rng = random.Random(seed)
+    
+    return {
+        'tokens': sentences,
+        'texts': [' '.join(words) for words in sentences],
+        'whitespace_texts': [
+            ''.join(word + rng.choice(WHITESPACE) for word in words)
+            for words in sentences],
+        }
+
+
+def transform_in_batches(tokenizer, inputs, batch_size, fast):
+    """Transform inputs in batches and concatenate output arrays."""
+    batches = [tokenizer.transform(inputs[i:i + batch_size], fast=fast)
+               for i in range(0, len(inputs), batch_size)]
+    
+    return [np.concatenate(arrays) for arrays in zip(*batches)]
+
+
+def check_tokenizer(tokenizer, inputs, batch_size, cache_size):
+    """
+    Compare compiled transform without and with token cache to Keras
+    transform for every kind of inputs. Return names of mismatching
+    inputs with speedup of compiled transform.
+    """
+    
+    mismatches, speedups = [], {}
+    for name, texts in inputs.items():
+        start = time.perf_counter()
+        expected = transform_in_batches(tokenizer, texts, batch_size, False)
+        reference_time = time.perf_counter() - start
+        
+        tokenizer.set_cache(None)
+        start = time.perf_counter()
+        output = transform_in_batches(tokenizer, texts, batch_size, True)
+        compiled_time = time.perf_counter() - start
+        
+        tokenizer.set_cache(cache_size)
+        cached = transform_in_batches(tokenizer, texts, batch_size, True)
+        tokenizer.set_cache(None)
+        
+        if not all(np.array_equal(exp, out) and exp.dtype == out.dtype
+                   for outputs in [output, cached]
+                   for exp, out in zip(expected, outputs)):
+            mismatches.append(name)
+        speedups[name] = reference_time / compiled_time
+    
+    return mismatches, speedups
+
+
+if __name__ == '__main__':
+    
+    parser = argparse.ArgumentParser(
+        description='Compare compiled and Keras CustomTokenizer.transform.')
+    parser.add_argument('--data', default='data/conll2003/train.txt',
+                        help='CoNLL file with sentences to transform')
+    parser.add_argument('--tokenizer', default='inference/tokenizer.joblib',
+                        help='fitted tokenizer checked besides tokenizers '
+                        'fitted with SETTINGS (skipped if missing)')
+    parser.add_argument('--max-seq-len', type=int, default=64)
+    parser.add_argument('--max-word-len', type=int, default=16)
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--cache-size', type=int, default=4096,
+                        help='token cache size of cached transform')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    
+    sentences, _ = read_txt_file(args.data)
+    inputs = get_inputs(sentences, args.seed)
+    
+    tokenizers = {}
+    if os.path.exists(args.tokenizer):
+        tokenizers['saved'] = joblib.load(args.tokenizer)
+    for name, settings in SETTINGS.items():
+        tokenizers[name] = CustomTokenizer(**settings).fit(
+            sentences, args.max_seq_len, args.max_word_len)
+    
+    result, failures = {}, []
+    for name, tokenizer in tokenizers.items():
+        mismatches, speedups = check_tokenizer(
+            tokenizer, inputs, args.batch_size, args.cache_size)
+        result[name] = {'fast_path': tokenizer._has_fast_path(),
+                        'mismatches': mismatches, 'speedup': speedups}
+        failures.extend(f'{name}/{kind}' for kind in mismatches)
+    print(json.dumps(result, indent=4))
+    
+    if failures:
+        raise SystemExit('Output differs for: {}'.format(failures))
@@ -7,24 +7,217 @@ import os
 
 import numpy as np
 
+from utils.batching import predict_in_batches
 from utils.encoders import indices_to_labels
 from utils.text import create_eval_file
 
 
+_END_OF_CHUNK = [('B', 'B'), ('B', 'O'), ('I', 'B'), ('I', 'O'), 
+                 ('E', 'E'), ('E', 'I'), ('E', 'O')]
+_START_OF_CHUNK = [('B', 'B'), ('I', 'B'), ('O', 'B'), ('O', 'I'), 
+                   ('E', 'E'), ('E', 'I'), ('O', 'E')]
+
+
+def _split_label(label):
+    """Split label into chunk tag and type, e.g. B-PER -> (B, PER)."""
+    tag, sep, chunk_type = label.partition('-')
+    return (tag, chunk_type) if sep else (label, '')
+
+
+def _get_chunk_bounds(tags, types, tag_names):
+    """
+    Flags of chunk end (before given position) and chunk start 
+    (at given position) following endOfChunk and startOfChunk 
+    from conlleval.pl. First position is preceded by O tag.
+    """
+    
+    prev_tags = np.concatenate([[tag_names.index('O')], tags[:-1]])
+    prev_types = np.concatenate([[0], types[:-1]])
+    type_changed = prev_types != types
+    
+    def pair_table(pairs):
+        table = np.zeros((len(tag_names), len(tag_names)), dtype=bool)
+        for prev_tag, tag in pairs:
+            if prev_tag in tag_names and tag in tag_names:
+                table[tag_names.index(prev_tag), tag_names.index(tag)] = True
+        return table
+    
+    def is_in(tags, names):
+        return np.isin(tags, [tag_names.index(n) for n in names 
+                              if n in tag_names])
+    
+    chunk_end = (pair_table(_END_OF_CHUNK)[prev_tags, tags]
+                 | ~is_in(prev_tags, ['O', '.']) & type_changed
+                 | is_in(prev_tags, ['[', ']']))
+    chunk_start = (pair_table(_START_OF_CHUNK)[prev_tags, tags]
+                   | ~is_in(tags, ['O', '.']) & type_changed
+                   | is_in(tags, ['[', ']']))
+    
+    return chunk_end, chunk_start
+
+
+def _get_prf(correct, found_guessed, found_correct):
+    """Precision, recall and FB1 (in %) computed as in conlleval.pl."""
+    precision = 100 * correct / found_guessed if found_guessed > 0 else 0.0
+    recall = 100 * correct / found_correct if found_correct > 0 else 0.0
+    f1 = (2 * precision * recall / (precision + recall) 
+          if precision + recall > 0 else 0.0)
+    
+    return precision, recall, f1
+
+
+def get_chunk_scores(true_ids, pred_ids, mask, classes):
+    """
+    Compute chunk level precision, recall and FB1 with exactly the same 
+    rules as conlleval.pl, but in-process on arrays of label ids of shape
+    (sentences, max_seq_len) with mask marking real tokens and classes
+    mapping ids to labels (e.g., LabelEncoder.classes_). 
+    Each row is treated as a separate sentence. Scores are given in %
+    and returned as dictionary with overall and per type results.
+    """
+    
+    mask = np.asarray(mask).astype(bool)
+    lengths = mask.sum(axis=1)
+    
+    # flat sequence of tokens with sentence boundary (O tag) after each row
+    n_tokens = int(lengths.sum())
+    positions = (np.arange(n_tokens) 
+                 + np.repeat(np.arange(len(lengths)), lengths))
+    is_token = np.zeros(n_tokens + len(lengths), dtype=bool)
+    is_token[positions] = True
+    
+    tag_names, type_names = ['O'], ['']
+    class_tags, class_types = [], []
+    for label in classes:
+        tag, chunk_type = _split_label(str(label))
+        for name, names, codes in [(tag, tag_names, class_tags), 
+                                   (chunk_type, type_names, class_types)]:
+            if name not in names:
+                names.append(name)
+            codes.append(names.index(name))
+    class_tags, class_types = np.array(class_tags), np.array(class_types)
+    
+    bounds, tags, types = {}, {}, {}
+    for name, ids in [('true', true_ids), ('pred', pred_ids)]:
+        tags[name] = np.zeros(len(is_token), dtype=np.int64)
+        types[name] = np.zeros(len(is_token), dtype=np.int64)
+        flat_ids = np.asarray(ids)[mask]
+        tags[name][positions] = class_tags[flat_ids]
+        types[name][positions] = class_types[flat_ids]
+        bounds[name] = _get_chunk_bounds(tags[name], types[name], tag_names)
+    
+    (true_end, true_start), (pred_end, pred_start) = \
+        bounds['true'], bounds['pred']
+    same_type = types['true'] == types['pred']
+    prev_same_type = np.concatenate([[True], same_type[:-1]])
+    
+    # state of inCorrect flag from conlleval.pl: set when both chunks start
+    # with the same type, kept while chunks neither end nor differ in type
+    both_start = true_start & pred_start & same_type
+    keep = (same_type & (true_end == pred_end) 
+            & ~(true_end & pred_end & prev_same_type))
+    index = np.arange(len(is_token))
+    last_start = np.maximum.accumulate(np.where(both_start, index, -1))
+    last_break = np.maximum.accumulate(np.where(~keep, index, -1))
+    in_correct = (last_start >= 0) & (last_start >= last_break)
+    
+    prev_in_correct = np.concatenate([[False], in_correct[:-1]])
+    correct_end = prev_in_correct & true_end & pred_end & prev_same_type
+    correct_types = np.concatenate([[0], types['true'][:-1]])[correct_end]
+    if len(in_correct) and in_correct[-1]:
+        correct_types = np.append(correct_types, types['true'][-1])
+    
+    n_found_correct = np.bincount(types['true'][true_start], 
+                                  minlength=len(type_names))
+    n_found_guessed = np.bincount(types['pred'][pred_start], 
+                                  minlength=len(type_names))
+    n_correct = np.bincount(correct_types, minlength=len(type_names))
+    correct_tags = ((tags['true'] == tags['pred']) & same_type)[is_token]
+    
+    precision, recall, f1 = _get_prf(n_correct.sum(), n_found_guessed.sum(),
+                                     n_found_correct.sum())
+    scores = {
+        'tokens': n_tokens,
+        'phrases': int(n_found_correct.sum()),
+        'found': int(n_found_guessed.sum()),
+        'correct': int(n_correct.sum()),
+        'accuracy': 100 * correct_tags.mean() if n_tokens else 0.0,
+        'precision': precision,
+        'recall': recall,
+        'f1': f1,
+        'types': {}
+        }
+    
+    for code in np.flatnonzero(n_found_correct + n_found_guessed):
+        precision, recall, f1 = _get_prf(
+            n_correct[code], n_found_guessed[code], n_found_correct[code])
+        scores['types'][type_names[code]] = {
+            'phrases': int(n_found_correct[code]),
+            'found': int(n_found_guessed[code]),
+            'correct': int(n_correct[code]),
+            'precision': precision,
+            'recall': recall,
+            'f1': f1
+            }
+    scores['types'] = dict(sorted(scores['types'].items()))
+    
+    return scores
+
+
+def format_chunk_scores(scores):
+    """Format scores from get_chunk_scores the same way as conlleval.pl."""
+    
+    lines = ['processed {} tokens with {} phrases; found: {} phrases; '
+             'correct: {}.'.format(scores['tokens'], scores['phrases'], 
+                                   scores['found'], scores['correct'])]
+    if scores['tokens'] > 0:
+        lines.append('accuracy: {:6.2f}%; precision: {:6.2f}%; '
+                     'recall: {:6.2f}%; FB1: {:6.2f}'.format(
+                         scores['accuracy'], scores['precision'], 
+                         scores['recall'], scores['f1']))
+    for chunk_type, type_scores in scores['types'].items():
+        lines.append('{:>17}: precision: {:6.2f}%; recall: {:6.2f}%; '
+                     'FB1: {:6.2f}  {}'.format(
+                         chunk_type, type_scores['precision'], 
+                         type_scores['recall'], type_scores['f1'], 
+                         type_scores['found']))
+    
+    return '\n'.join(lines) + '\n'
+
+
 def evaluate(sentences, labels, label_encoder, X, y_mask, model,
              directory='evaluation', pred_file='pred.txt',
-             eval_file='eval.txt', script_file='conlleval.pl'):
+             eval_file='eval.txt', script_file='conlleval.pl',
+             batch_size=64, buckets=None, use_perl=False):
     """
-    Create evaluation file with script_file Perl script and print 
-    the evaluation result.
+    Evaluate model on chunk level, print the evaluation result in 
+    conlleval format and return scores from get_chunk_scores.
+    With use_perl, evaluation file is created and evaluated with 
+    script_file Perl script instead (result is only printed).
+    If buckets are given, predictions are made on length buckets 
+    (see utils.batching.predict_in_batches).
     """
     
+    pred_ids = predict_in_batches(model, X, batch_size, buckets)
+    pred_ids = np.argmax(pred_ids, axis=-1)
+    
+    if not use_perl:
+        mask = y_mask.astype(bool)
+        true_labels = [label for labels_per_sentence, n_tokens 
+                       in zip(labels, mask.sum(axis=1))
+                       for label in labels_per_sentence[:n_tokens]]
+        true_ids = np.zeros_like(pred_ids)
+        true_ids[mask] = label_encoder.transform(true_labels)
+        scores = get_chunk_scores(true_ids, pred_ids, mask, 
+                                  label_encoder.classes_)
+        print(format_chunk_scores(scores))
+        
+        return scores
+    
     pred_path = os.path.join(directory, pred_file)
     eval_path = os.path.join(directory, eval_file)
     script_path = os.path.join(directory, script_file)
     
-    pred_ids = model.predict(X)
-    pred_ids = np.argmax(pred_ids, axis=-1)
     pred_labels = indices_to_labels(
         label_encoder, pred_ids, y_mask.astype(bool)
     )
@@ -3,16 +3,26 @@
 """Hyperparameter tuning."""
 
 
+import argparse
 import json
+import os
+import socket
+import subprocess
+import sys
 
 import joblib
 import keras_tuner as kt
+import numpy as np
 import tensorflow as tf
 import tensorflowjs as tfjs
 from tensorflow.keras.layers import (Bidirectional, Concatenate, Conv1D,
                                      Dense, Dropout, Embedding, GlobalMaxPool1D, 
                                      Input, LSTM, TimeDistributed)
 
+from utils.encoders import SequentialLabelEncoder
+from utils.numpy_model import QUANTIZATIONS, export_npz
+from utils.pipeline import (build_dataset_cache, load_split_arrays, 
+                            make_array_dataset, make_dataset)
 from utils.text import get_glove_embedding_matrix
 
 
@@ -23,6 +33,112 @@ def tf_set_memory_growth():
         tf.config.experimental.set_memory_growth(gpu_devices[0], True)
 
 
+def tf_set_threads(intra_op, inter_op=2):
+    """
+    Limit TensorFlow thread pools, e.g., so that several tuner workers 
+    running on one machine do not oversubscribe CPU cores.
+    """
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op)
+
+
+def run_distributed_search(n_workers, argv=(), threads=None, 
+                           chief_timeout=None):
+    """
+    Run hyperparameter search in n_workers processes sharing one oracle 
+    through keras-tuner distributed mode: this script is started once as 
+    chief (serving the oracle) and n_workers times as tuner worker with 
+    given command line arguments. Each worker is limited to threads 
+    intra-op threads (CPU count divided by n_workers by default).
+    Once workers are done, chief is waited for until it saves the oracle
+    state and exits (at most chief_timeout seconds if given); it is 
+    terminated right away if any worker failed.
+    """
+    
+    threads = threads or max(1, (os.cpu_count() or 1) // n_workers)
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    
+    env = {**os.environ, 'KERASTUNER_ORACLE_IP': '127.0.0.1', 
+           'KERASTUNER_ORACLE_PORT': str(port)}
+    command = [sys.executable, '-m', 'model_tf.model_tuner', 
+               '--threads', str(threads), *argv]
+    
+    chief = subprocess.Popen(command, env={**env, 
+                                           'KERASTUNER_TUNER_ID': 'chief'})
+    workers = [
+        subprocess.Popen(command, env={**env, 
+                                       'KERASTUNER_TUNER_ID': f'tuner{i}'})
+        for i in range(n_workers)]
+    try:
+        return_codes = [worker.wait() for worker in workers]
+        if not any(return_codes):
+            chief.wait(timeout=chief_timeout)
+    except subprocess.TimeoutExpired:
+        print(f'Chief did not exit within {chief_timeout}s after tuner '
+              'workers, terminating it; oracle state may be incomplete.')
+    finally:
+        for process in workers + [chief]:
+            if process.poll() is None:
+                process.terminate()
+                process.wait()
+    
+    if any(return_codes):
+        raise RuntimeError(
+            'Tuner workers failed with return codes {}.'.format(return_codes))
+
+
+def get_dynamic_length_model(model):
+    """
+    Rebuild model with variable sequence length inputs sharing weights 
+    of the given model, so that it can be run on batches padded to any
+    sequence length (e.g., length buckets) instead of MAX_SEQ_LEN.
+    """
+    
+    config = model.get_config()
+    for layer in config['layers']:
+        layer_config = layer['config']
+        if layer['class_name'] == 'InputLayer':
+            shape = layer_config['batch_input_shape']
+            layer_config['batch_input_shape'] = \
+                [shape[0], None] + list(shape[2:])
+        elif layer['class_name'] == 'Embedding':
+            layer_config['input_length'] = None
+    
+    dynamic_model = tf.keras.Model.from_config(config)
+    dynamic_model.set_weights(model.get_weights())
+    
+    return dynamic_model
+
+
+class TracedPredictModel:
+    """
+    Variable sequence length model (see get_dynamic_length_model) with 
+    predict_on_batch running tf.function traced once for input signature 
+    of any batch size and sequence length, so that batches trimmed to 
+    different lengths do not trigger retracing.
+    """
+    
+    def __init__(self, model):
+        self.model = model
+        signature = [
+            tf.TensorSpec((None, None) + tuple(inp.shape[2:]), tf.int32)
+            for inp in model.inputs]
+        
+        @tf.function(input_signature=[signature])
+        def predict(inputs):
+            return model([tf.cast(x, inp.dtype) 
+                          for x, inp in zip(inputs, model.inputs)], 
+                         training=False)
+        
+        self._predict = predict
+    
+    def predict_on_batch(self, X):
+        """Predict label probabilities for list of input arrays."""
+        return self._predict([tf.cast(x, tf.int32) for x in X]).numpy()
+
+
 def build_model(hp):
     """Build Keras model with hyperparameters."""
     
@@ -89,21 +205,113 @@ if __name__ == '__main__':
     # save best model in h5 format and convert to tfjs for web app deployment;
     # evaluate on train, validation and test datasets;
     
+    parser = argparse.ArgumentParser(
+        description='Tune, train and export NER model.')
+    parser.add_argument('--streaming', action='store_true',
+                        help='stream CoNLL files through tf.data pipeline '
+                        'instead of reading dataset cache')
+    parser.add_argument('--joblib', action='store_true',
+                        help='load preprocessed arrays from data/data.joblib '
+                        'into memory instead of reading dataset cache')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of parallel tuner worker processes '
+                        'sharing one oracle')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='intra-op threads per process (CPU count '
+                        'divided by number of workers by default)')
+    parser.add_argument('--data-cache', default='data/cache',
+                        help='directory with npy arrays encoded from CoNLL '
+                        'files, memory mapped by every process')
+    parser.add_argument('--chief-timeout', type=float, default=None,
+                        help='seconds to wait for oracle chief after tuner '
+                        'workers are done before terminating it (no limit '
+                        'by default)')
+    args = parser.parse_args()
+    
+    # KERASTUNER_TUNER_ID is set for processes started by 
+    # run_distributed_search, which only run the search
+    role = os.environ.get('KERASTUNER_TUNER_ID')
+    distributed = args.workers > 1 and role is None
+    
+    if args.threads:
+        tf_set_threads(args.threads)
     tf_set_memory_growth()
     
     with open('config.json') as config_file:
         conf = json.load(config_file)
-        
-    data = joblib.load('data/data.joblib')
-    X_train, y_train, y_train_mask = data['train']
-    X_valid, y_valid, y_valid_mask = data['valid']
-    X_test, y_test, y_test_mask = data['test']
     
-    word_index = (joblib.load('inference/tokenizer.joblib')
-                  .word_tokenizer.word_index)
-    EMBEDDING_MATRIX = get_glove_embedding_matrix(
-        'data/glove.6B.100d.txt', word_index
-    )
+    tokenizer = joblib.load('inference/tokenizer.joblib')
+    label_encoder = SequentialLabelEncoder.from_label_encoder(
+        joblib.load('inference/label_encoder.joblib'), conf['MAX_SEQ_LEN']
+        )
+    
+    if role == 'chief':
+        # chief only serves the oracle (and builds model to populate search
+        # space once the search is over), hence data are not loaded
+        fit_data, eval_data = {}, {}
+    elif args.streaming:
+        train_data = make_dataset(conf['PATH_TRAIN'], tokenizer, 
+                                  label_encoder, batch_size=64, 
+                                  shuffle_buffer=10000)
+        valid_data = make_dataset(conf['PATH_VALID'], tokenizer, 
+                                  label_encoder, batch_size=64)
+        test_data = make_dataset(conf['PATH_TEST'], tokenizer, 
+                                 label_encoder, batch_size=64)
+        fit_data = {'x': train_data, 'validation_data': valid_data}
+        eval_data = {'training': {'x': train_data}, 
+                     'validation': {'x': valid_data}, 
+                     'test': {'x': test_data}}
+    elif args.joblib:
+        data = joblib.load('data/data.joblib')
+        X_train, y_train, y_train_mask = data['train']
+        X_valid, y_valid, y_valid_mask = data['valid']
+        X_test, y_test, y_test_mask = data['test']
+        fit_data = {'x': X_train, 'y': y_train, 'sample_weight': y_train_mask, 
+                    'validation_data': (X_valid, y_valid, y_valid_mask), 
+                    'batch_size': 64, 'shuffle': True}
+        eval_data = {
+            'training': {'x': X_train, 'y': y_train, 
+                         'sample_weight': y_train_mask},
+            'validation': {'x': X_valid, 'y': y_valid, 
+                           'sample_weight': y_valid_mask},
+            'test': {'x': X_test, 'y': y_test, 'sample_weight': y_test_mask}
+            }
+    else:
+        # arrays are encoded only if config, vocabularies or CoNLL files 
+        # changed (by the main process) and memory mapped read-only by 
+        # each process
+        if role is None:
+            build_dataset_cache(args.data_cache, conf, tokenizer, 
+                                label_encoder)
+        data = load_split_arrays(args.data_cache)
+        train_data = make_array_dataset(data['train'], batch_size=64, 
+                                        shuffle=True)
+        valid_data = make_array_dataset(data['valid'], batch_size=64)
+        test_data = make_array_dataset(data['test'], batch_size=64)
+        fit_data = {'x': train_data, 'validation_data': valid_data}
+        eval_data = {'training': {'x': train_data}, 
+                     'validation': {'x': valid_data}, 
+                     'test': {'x': test_data}}
+    
+    glove_path = 'data/glove.6B.100d.txt'
+    word_index = tokenizer.word_tokenizer.word_index
+    if role == 'chief':
+        # only shape of embedding matrix matters for chief
+        with open(glove_path, encoding='utf-8') as glove_file:
+            glove_dim = len(glove_file.readline().split()) - 1
+        EMBEDDING_MATRIX = np.zeros((len(word_index), glove_dim), 
+                                    dtype='float32')
+    else:
+        EMBEDDING_MATRIX = get_glove_embedding_matrix(glove_path, word_index)
+    
+    if distributed:
+        argv = ['--data-cache', args.data_cache]
+        if args.streaming:
+            argv.append('--streaming')
+        if args.joblib:
+            argv.append('--joblib')
+        run_distributed_search(args.workers, argv, args.threads, 
+                               args.chief_timeout)
     
     es_callback = tf.keras.callbacks.EarlyStopping(
         monitor='val_sparse_categorical_crossentropy', min_delta=0, 
@@ -117,24 +325,48 @@ if __name__ == '__main__':
         project_name='hptuning'
         )
     
-    fit_args = {'x': X_train, 'y': y_train, 'sample_weight': y_train_mask, 
-                'validation_data': (X_valid, y_valid, y_valid_mask), 
-                'epochs': 50, 'batch_size': 64, 'shuffle': True,
-                'verbose': 2, 'callbacks': [es_callback]}
+    fit_args = {**fit_data, 'epochs': 50, 'verbose': 2, 
+                'callbacks': [es_callback]}
 
-    tuner.search(**fit_args)
+    if role is not None:
+        tuner.search(**fit_args)
+        sys.exit(0)
+    if not distributed:
+        tuner.search(**fit_args)
     best_hparams = tuner.get_best_hyperparameters(num_trials=1)[0]
     model = tuner.hypermodel.build(best_hparams)
     print(model.summary())
     model.fit(**fit_args)
     
     model.save('inference/h5_model/model.h5')
+    export_npz(model, 'inference/model.npz')
     tfjs.converters.save_keras_model(model, 'web-app/tfjs_model')
     
+    # float16 and int8 variants (tfjs uses affine uint8 quantization)
+    tfjs_dtypes = {'float16': 'float16', 'int8': 'uint8'}
+    for quantization in QUANTIZATIONS:
+        export_npz(model, f'inference/model_{quantization}.npz', 
+                   quantization)
+        tfjs.converters.save_keras_model(
+            model, f'web-app/tfjs_model_{quantization}', 
+            quantization_dtype_map={tfjs_dtypes[quantization]: '*'})
+    
     print('\n')
-    print('Categorical crossentropy and Accuracy for training data: {}.'.format(
-        model.evaluate(x=X_train, y=y_train, sample_weight=y_train_mask, verbose=0)[1:]))
-    print('Categorical crossentropy and Accuracy for validation data: {}.'.format(
-        model.evaluate(x=X_valid, y=y_valid, sample_weight=y_valid_mask, verbose=0)[1:]))
-    print('Categorical crossentropy and Accuracy for test data: {}.'.format(
-        model.evaluate(x=X_test, y=y_test, sample_weight=y_test_mask, verbose=0)[1:]))
+    for name, eval_args in eval_data.items():
+        print('Categorical crossentropy and Accuracy for {} data: {}.'.format(
+            name, model.evaluate(**eval_args, verbose=0)[1:]))
+    
+    # benchmark package is imported only for the report after training,
+    # so that loading Keras model for inference does not import it
+    from benchmark.quantization import (get_eval_data, 
+                                        get_quantization_report, 
+                                        get_variants)
+    
+    label_encoder = joblib.load('inference/label_encoder.joblib')
+    X_test_eval, test_ids, test_mask = get_eval_data(
+        conf['PATH_TEST'], tokenizer, label_encoder)
+    quantization_report = get_quantization_report(
+        get_variants(), X_test_eval, test_ids, test_mask, 
+        label_encoder.classes_)
+    print('\nQuantized variants compared with float32 models on test data:')
+    print(json.dumps(quantization_report, indent=4))
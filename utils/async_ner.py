@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+"""Asyncio interface to NER model with micro-batching and backpressure."""
+
+
+import asyncio
+
+from utils.server import MicroBatcher
+
+
+OVERLOAD_POLICIES = ('wait', 'reject')
+
+
+class OverloadedError(RuntimeError):
+    """Raised when texts cannot be queued because queue limit is reached."""
+
+
+class AsyncNER:
+    """
+    Asyncio wrapper of getPredictedNER. Texts of concurrent apredict and
+    apredict_batch calls are coalesced into micro-batches tagged by
+    MicroBatcher in its single worker thread, so that neither
+    preprocessing nor model prediction run on the event loop.
+    At most max_pending texts are queued or being tagged at once. Calls
+    over that limit wait for capacity (overload='wait', at most
+    wait_timeout seconds if given) or fail immediately with
+    OverloadedError (overload='reject').
+    """
+    
+    def __init__(self, get_ner, max_batch_size=64, max_wait=0.005,
+                 max_pending=1024, overload='wait', wait_timeout=None):
+        if overload not in OVERLOAD_POLICIES:
+            raise ValueError("Overload policy must be 'wait' or 'reject'.")
+        
+        self.get_ner = get_ner
+        self.max_pending = max_pending
+        self.overload = overload
+        self.wait_timeout = wait_timeout
+        self.batcher = MicroBatcher(get_ner.predict_batch, max_batch_size,
+                                    max_wait)
+        
+        self._pending = 0
+        self._rejected = 0
+        self._capacity = None
+        self._capacity_loop = None
+    
+    def _has_capacity(self, n_texts):
+        return self._pending + n_texts <= self.max_pending
+    
+    def _get_capacity(self):
+        """
+        Condition notified when queue capacity is released, created for 
+        running event loop on first use (asyncio primitives are bound to 
+        event loop when created in Python < 3.10, whereas AsyncNER is 
+        usually created before asyncio.run).
+        """
+        loop = asyncio.get_running_loop()
+        if self._capacity_loop is not loop:
+            self._capacity = asyncio.Condition()
+            self._capacity_loop = loop
+        
+        return self._capacity
+    
+    async def _acquire(self, n_texts):
+        """Reserve queue capacity for n_texts texts."""
+        
+        if n_texts > self.max_pending:
+            raise ValueError('Number of texts exceeds max_pending.')
+        
+        capacity = self._get_capacity()
+        async with capacity:
+            if not self._has_capacity(n_texts):
+                if self.overload == 'reject':
+                    self._rejected += 1
+                    raise OverloadedError(
+                        f'{self._pending} texts pending, queue is full.')
+                try:
+                    await asyncio.wait_for(capacity.wait_for(
+                        lambda: self._has_capacity(n_texts)),
+                        self.wait_timeout)
+                except asyncio.TimeoutError:
+                    self._rejected += 1
+                    raise OverloadedError(
+                        f'No queue capacity within {self.wait_timeout}s.'
+                        ) from None
+            self._pending += n_texts
+    
+    async def _release(self, n_texts):
+        """Return capacity of n_texts texts and wake up waiting calls."""
+        capacity = self._get_capacity()
+        async with capacity:
+            self._pending -= n_texts
+            capacity.notify_all()
+    
+    async def apredict_batch(self, texts):
+        """
+        Tag list of texts and return list of (token, tag) lists, one per
+        text. Texts are dropped from queue if the call is cancelled
+        before they are tagged.
+        """
+        
+        texts = list(texts)
+        await self._acquire(len(texts))
+        try:
+            return await asyncio.wrap_future(self.batcher.submit(texts))
+        finally:
+            await self._release(len(texts))
+    
+    async def apredict(self, text):
+        """Tag text and return list of (token, tag) tuples."""
+        return (await self.apredict_batch([text]))[0]
+    
+    def stats(self):
+        """MicroBatcher statistics with pending and rejected counts."""
+        return {**self.batcher.stats(), 'pending': self._pending,
+                'rejected': self._rejected}
+    
+    async def aclose(self):
+        """Stop worker thread after queued texts are tagged."""
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.batcher.close)
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+"""Batching of model inputs for inference."""
+
+
+import itertools
+
+import numpy as np
+
+
+def iter_chunks(iterable, size):
+    """Yield consecutive lists of at most size elements from iterable."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def get_bucket_ids(lengths, buckets):
+    """
+    Assign each sequence length to the smallest bucket able to hold it.
+    Buckets have to be sorted in ascending order.
+    """
+    
+    lengths = np.asarray(lengths)
+    if len(lengths) and lengths.max() > buckets[-1]:
+        raise ValueError('Sequence longer than the largest bucket.')
+    
+    return np.searchsorted(buckets, lengths)
+
+
+def predict_in_batches(model, X, batch_size=64, buckets=None, trim=False):
+    """
+    Predict model outputs for inputs X (list of arrays with input mask as 
+    the last one) in batches of batch_size rows.
+    If buckets (ascending sequence lengths, e.g. (16, 32, 64)) are given,
+    rows are grouped by their real length and each group is trimmed to 
+    its bucket length before predict, so that model has to accept variable
+    sequence length (see model_tf.model_tuner.get_dynamic_length_model).
+    With trim, each batch is further trimmed to its longest real sequence.
+    Outputs are returned in the original order and padded back to the 
+    sequence length of X.
+    """
+    
+    n_rows, seq_len = X[-1].shape
+    lengths = X[-1].astype(bool).sum(axis=1)
+    
+    if buckets is None:
+        buckets = [seq_len]
+    buckets = sorted(set(buckets) | {seq_len})
+    bucket_ids = get_bucket_ids(lengths, buckets)
+    
+    output = None
+    for bucket_id, bucket_len in enumerate(buckets):
+        rows = np.flatnonzero(bucket_ids == bucket_id)
+        for i in range(0, len(rows), batch_size):
+            batch_rows = rows[i:i + batch_size]
+            batch_len = bucket_len
+            if trim:
+                batch_len = max(int(lengths[batch_rows].max()), 1)
+            pred = np.asarray(model.predict_on_batch(
+                [x[batch_rows, :batch_len] for x in X]))
+            if output is None:
+                output = np.zeros((n_rows, seq_len) + pred.shape[2:], 
+                                  dtype=pred.dtype)
+            output[batch_rows, :batch_len] = pred
+    
+    return output
@@ -7,23 +7,60 @@ import itertools
 
 import numpy as np
 from sklearn.preprocessing import LabelEncoder
-from tensorflow.keras.preprocessing.sequence import pad_sequences
 
+from utils.text import get_ragged_positions
 
-def indices_to_labels(label_encoder, pred_array, bool_mask_array=None):
+
+def _get_row_offsets(lengths):
+    """Offsets of rows in flat array, e.g. [2, 1] -> [0, 2, 3]."""
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    
+    return offsets
+
+
+def _get_unseen_labels_error(labels):
+    """Error raised for labels (or indices) missing in fitted classes."""
+    return ValueError('y contains previously unseen labels: {}'.format(
+        sorted(set(labels), key=str)))
+
+
+def indices_to_labels(label_encoder, pred_array, bool_mask_array=None,
+                      return_offsets=False):
     """
     Create labels from indices predicted by a model and potentially apply 
     a boolean mask for rows with padded indices.
-    Given label_encoder should provide an inverse_transform method.
+    Given label_encoder should provide a classes_ array (as fitted sklearn
+    LabelEncoder) or an inverse_transform method. Labels of all rows are
+    gathered at once and split into nested list, unless return_offsets is
+    True, in which case flat labels array and row offsets are returned
+    (labels of row i are labels[offsets[i]:offsets[i + 1]]).
     """
     
+    pred_array = np.asarray(pred_array)
     if bool_mask_array is None:
-        bool_mask_array = np.ones(pred_array.shape).astype(bool)
+        bool_mask_array = np.ones(pred_array.shape, dtype=bool)
+    bool_mask_array = np.asarray(bool_mask_array, dtype=bool)
     
-    pred_labels = [
-        label_encoder.inverse_transform(pred[mask]).tolist()
-        for pred, mask in zip(pred_array, bool_mask_array)
-        ]
+    indices = pred_array[bool_mask_array]
+    classes = getattr(label_encoder, 'classes_', None)
+    if classes is None:
+        labels = np.asarray(label_encoder.inverse_transform(indices))
+    else:
+        classes = np.asarray(classes)
+        if indices.size and (indices.min() < 0 or 
+                             indices.max() >= len(classes)):
+            raise _get_unseen_labels_error(
+                indices[(indices < 0) | (indices >= len(classes))].tolist())
+        labels = classes[indices]
+    
+    offsets = _get_row_offsets(bool_mask_array.sum(axis=1))
+    if return_offsets:
+        return labels, offsets
+    
+    labels, offsets = labels.tolist(), offsets.tolist()
+    pred_labels = [labels[start:end] 
+                   for start, end in zip(offsets[:-1], offsets[1:])]
     
     return pred_labels
 
@@ -34,6 +71,18 @@ class SequentialLabelEncoder:
     def __init__(self):
         self.le = LabelEncoder()
     
+    @classmethod
+    def from_label_encoder(cls, label_encoder, max_seq_len, pad_value=0.0):
+        """Create encoder from already fitted sklearn LabelEncoder."""
+        
+        encoder = cls()
+        encoder.le = label_encoder
+        encoder.max_seq_len = max_seq_len
+        encoder.pad_value = pad_value
+        encoder._fitted = True
+        
+        return encoder
+    
     def fit(self, labels, max_seq_len=None, pad_value=0.0):
         """
         Fit LabelEncoder to flattened list of labels. Labels for input 
@@ -56,23 +105,52 @@ class SequentialLabelEncoder:
         
         return self
         
+    def _check_if_fitted(self):
+        """Raise error if encoder is not fitted."""
+        if not getattr(self, '_fitted', False):
+            raise AttributeError('SequentialLabelEncoder not fitted yet.')
+    
+    def transform_flat(self, labels, dtype='int32'):
+        """
+        Encode labels truncated to max_seq_len into flat array of ids and
+        row offsets (ids of row i are ids[offsets[i]:offsets[i + 1]]).
+        Labels of all rows are looked up at once in label to id mapping.
+        """
+        
+        self._check_if_fitted()
+        
+        labels = [seq[:self.max_seq_len] for seq in labels]
+        lbs_flattened = list(itertools.chain.from_iterable(labels))
+        label_ids = {label: idx for idx, label 
+                     in enumerate(self.le.classes_.tolist())}
+        
+        try:
+            lbs_encoded = np.fromiter(map(label_ids.__getitem__, 
+                                          lbs_flattened),
+                                      dtype=dtype, count=len(lbs_flattened))
+        except KeyError:
+            raise _get_unseen_labels_error(
+                [lb for lb in lbs_flattened if lb not in label_ids]
+                ) from None
+        
+        return lbs_encoded, _get_row_offsets([len(seq) for seq in labels])
+    
     def transform(self, labels, return_mask=True, dtype='int32'):
         """
         Transform labels with fitted encoder and pad to max_seq_len.
+        Encoded labels of all rows are scattered into preallocated array.
         """
         
-        if not self._fitted:
-            raise AttributeError('SequentialLabelEncoder not fitted yet.')
-        
-        lbs_encoded = [self.le.transform(seq).tolist() for seq in labels]
+        lbs_flattened, offsets = self.transform_flat(labels, dtype)
+        positions = get_ragged_positions(np.diff(offsets))
         
-        lbs_encoded = pad_sequences(lbs_encoded, maxlen=self.max_seq_len, 
-                                    padding='post', truncating='post', 
-                                    value=-1.0).astype(dtype)
-        lbs_mask = (lbs_encoded != -1.0).astype(dtype)
-        lbs_encoded[~lbs_mask.astype(bool)] = self.pad_value
+        lbs_encoded = np.full((len(offsets) - 1, self.max_seq_len), 
+                              self.pad_value, dtype=dtype)
+        lbs_encoded[positions] = lbs_flattened
         
         if return_mask:
+            lbs_mask = np.zeros(lbs_encoded.shape, dtype=dtype)
+            lbs_mask[positions] = 1
             return lbs_encoded, lbs_mask
         
         return lbs_encoded
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+"""Incremental tagging of repeatedly edited documents."""
+
+
+import hashlib
+import re
+from collections import OrderedDict
+
+
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+|\n+')
+
+
+def split_sentences(text):
+    """
+    Split text into sentences at whitespace following sentence final
+    punctuation and at line breaks, skipping empty ones.
+    """
+    return [sentence for sentence in map(str.strip,
+                                         SENTENCE_BOUNDARY.split(text))
+            if sentence]
+
+
+def get_sentence_key(sentence):
+    """Content hash of sentence used as cache key."""
+    return hashlib.blake2b(sentence.encode('utf-8'),
+                           digest_size=16).digest()
+
+
+class IncrementalNER:
+    """
+    Wrapper of getPredictedNER tagging documents sentence by sentence with
+    (token, tag) lists of at most cache_size sentences kept in LRU cache
+    keyed by content hash. When an edited document is submitted again,
+    only its new or changed sentences go through preprocessing, tokenizer
+    and model. Sentences are tagged independently of each other, hence
+    tags can differ from tagging the whole document at once.
+    """
+    
+    def __init__(self, get_ner, cache_size=4096):
+        if cache_size < 1:
+            raise ValueError('Cache size must be a positive integer.')
+        
+        self.get_ner = get_ner
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+    
+    def __len__(self):
+        return len(self._cache)
+    
+    def predict_batch(self, texts, batch_size=None):
+        """
+        Tag list of texts and return list of (token, tag) lists, one per
+        text. Sentences missing from cache are tagged together in batches
+        of batch_size sentences.
+        """
+        
+        docs_keys, sentences = [], {}
+        for text in texts:
+            keys = []
+            for sentence in split_sentences(text):
+                key = get_sentence_key(sentence)
+                sentences.setdefault(key, sentence)
+                keys.append(key)
+            docs_keys.append(keys)
+        
+        outputs, missing = {}, []
+        for key in sentences:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                outputs[key] = self._cache[key]
+            else:
+                missing.append(key)
+        
+        n_sentences = sum(map(len, docs_keys))
+        self.misses += len(missing)
+        self.hits += n_sentences - len(missing)
+        
+        if missing:
+            ner_outputs = self.get_ner.predict_batch(
+                [sentences[key] for key in missing], batch_size)
+            for key, ner_output in zip(missing, ner_outputs):
+                outputs[key] = self._cache[key] = ner_output
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        
+        return [[pair for key in keys for pair in outputs[key]]
+                for keys in docs_keys]
+    
+    def __call__(self, input_text):
+        return self.predict_batch([input_text])[0]
+    
+    def stats(self):
+        """Numbers of cached sentences, cache hits and misses."""
+        return {'sentences': len(self._cache), 'hits': self.hits,
+                'misses': self.misses}
+    
+    def clear(self):
+        """Remove all sentences and reset counters."""
+        self._cache.clear()
+        self.hits = 0
+        self.misses = 0
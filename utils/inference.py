@@ -5,57 +5,323 @@
 
 import argparse
 import os
+import time
 from dataclasses import dataclass
 
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 
 import joblib
 import numpy as np
-import tensorflow as tf
-from tensorflow.keras import Model as KerasModel
 
-from model_tf.model_tuner import tf_set_memory_growth
-from utils.text import CustomTokenizer, TextPreprocessor
+from utils.batching import iter_chunks, predict_in_batches
+from utils.instrumentation import DISABLED_RECORD, Instrumentation
+from utils.numpy_model import QUANTIZATIONS, NumpyNERModel
+from utils.text import CustomTokenizer, TextPreprocessor, load_vocab_bundle
+
+
+def get_window_starts(n_tokens, window, overlap):
+    """
+    Start positions of windows of given length that cover n_tokens tokens
+    with consecutive windows sharing overlap tokens.
+    """
+    
+    if not 0 <= overlap < window:
+        raise ValueError('Window overlap must be in [0, window) range.')
+    
+    starts = [0]
+    while starts[-1] + window < n_tokens:
+        starts.append(starts[-1] + window - overlap)
+    
+    return starts
+
+
+def stitch_windows(window_tags, window, overlap):
+    """
+    Merge tags predicted for consecutive overlapping windows into tags for
+    the whole token stream. Within each overlap the first half of tokens 
+    is taken from the earlier window and the second half from the later 
+    one, so every token is tagged by the window where it has more context.
+    """
+    
+    stride = window - overlap
+    tags = []
+    for i, tags_per_window in enumerate(window_tags):
+        start = 0 if i == 0 else overlap // 2
+        end = None if i == len(window_tags) - 1 else stride + overlap // 2
+        tags.extend(tags_per_window[start:end])
+    
+    return tags
 
 
 @dataclass
 class getPredictedNER:
-    """End to end NER prediction for given text."""
+    """
+    End to end NER prediction for given text with Keras model or 
+    NumpyNERModel.
+    """
     preprocessor: TextPreprocessor
     tokenizer: CustomTokenizer
-    model: KerasModel
+    model: object
     labels: list
+    batch_size: int = 64
+    windowed: bool = False
+    window_overlap: int = 16
+    buckets: tuple = None
+    trim: bool = False
+    instrumentation: Instrumentation = None
     
-    def __call__(self, input_text):
-        input_text = self.preprocessor(input_text)
-        input_X = self.tokenizer.transform(input_text)
-        input_mask = np.squeeze(input_X[-1]).astype(bool)
-        input_tokens = self.tokenizer.get_original_tokens(input_text)
-        pred_ids = np.argmax(self.model.predict(input_X), axis=-1)
-        pred_ids = np.squeeze(pred_ids)[input_mask]
-        pred_cls = [self.labels[idx] for idx in pred_ids]
-        ner_output = [(tkn, ner) for tkn, ner 
-                      in zip(input_tokens, pred_cls)]
+    def _predict_rows(self, rows, batch_size, record=DISABLED_RECORD):
+        """
+        Predict label ids for token rows (at most max_seq_len tokens each) 
+        in batches of batch_size rows (grouped into length buckets if set,
+        trimmed to the longest sequence in batch if trim is True) and 
+        return them with input mask.
+        """
+        with record.stage('tokenize'):
+            input_X = self.tokenizer.transform(rows)
+            input_mask = input_X[-1].astype(bool)
+        with record.stage('predict'):
+            pred = predict_in_batches(self.model, input_X, batch_size, 
+                                      self.buckets, self.trim)
+        
+        if record.enabled:
+            word_index = self.tokenizer.word_tokenizer.word_index
+            oov_id = word_index[self.tokenizer.oov_token]
+            record.count('model_tokens', input_mask.sum())
+            record.count('oov_tokens', 
+                         (input_X[0][input_mask] == oov_id).sum())
+        
+        return np.argmax(pred, axis=-1), input_mask
+    
+    def decode_rows(self, pred_ids, input_mask):
+        """
+        Tags of label ids under input mask gathered for all rows at once
+        and split into list of tags per row.
+        """
+        tags = np.asarray(self.labels)[pred_ids[input_mask]].tolist()
+        ends = np.cumsum(input_mask.sum(axis=1)).tolist()
+        
+        return [tags[start:end] for start, end in zip([0] + ends, ends)]
+    
+    def _tag_chunk(self, texts, batch_size, record=DISABLED_RECORD):
+        """
+        Tag list of texts with all their rows (windows) predicted together.
+        """
+        with record.stage('preprocess'):
+            texts = self.preprocessor(texts)
+        max_seq_len = self.tokenizer.max_seq_len
+        
+        docs_tokens, docs_windows, rows = [], [], []
+        with record.stage('tokenize'):
+            for text in texts:
+                tokens = self.tokenizer.get_original_tokens(
+                    text, truncate=False)
+                record.count('tokens', len(tokens))
+                if not self.windowed:
+                    record.count('truncated_tokens', 
+                                 max(len(tokens) - max_seq_len, 0))
+                    tokens = tokens[:max_seq_len]
+                starts = [0]
+                if self.windowed:
+                    starts = get_window_starts(len(tokens), max_seq_len, 
+                                               self.window_overlap)
+                docs_tokens.append(tokens)
+                docs_windows.append(range(len(rows), 
+                                          len(rows) + len(starts)))
+                rows.extend(tokens[s:s + max_seq_len] for s in starts)
+        
+        if record.enabled:
+            max_word_len = self.tokenizer.max_word_len
+            record.count('documents', len(texts))
+            record.count('truncated_chars', sum(
+                max(len(token) - max_word_len, 0) 
+                for tokens in docs_tokens for token in tokens))
+        
+        pred_ids, input_mask = self._predict_rows(rows, batch_size, record)
+        
+        with record.stage('decode'):
+            rows_tags = self.decode_rows(pred_ids, input_mask)
+        
+        ner_outputs = []
+        for tokens, windows in zip(docs_tokens, docs_windows):
+            pred_cls = stitch_windows([rows_tags[i] for i in windows], 
+                                      max_seq_len, self.window_overlap)
+            ner_outputs.append([(tkn, ner) for tkn, ner 
+                                in zip(tokens, pred_cls)])
+        
+        return ner_outputs
+    
+    def predict_batch(self, texts, batch_size=None, return_stats=False):
+        """
+        Tag list (or any iterable) of texts packed into model batches of 
+        batch_size documents. Returns list of (token, tag) lists, one per 
+        document, and optionally a dictionary with throughput statistics.
+        """
+        
+        batch_size = batch_size or self.batch_size
+        record = DISABLED_RECORD
+        if self.instrumentation is not None:
+            record = self.instrumentation.new_record()
+        
+        start = time.perf_counter()
+        ner_outputs = []
+        for chunk in iter_chunks(texts, batch_size):
+            ner_outputs.extend(self._tag_chunk(chunk, batch_size, record))
+        elapsed = time.perf_counter() - start
         
-        return ner_output
+        if record.enabled:
+            record.stages['total'] = elapsed
+            self.instrumentation.add(record)
+        
+        if return_stats:
+            stats = {'documents': len(ner_outputs), 'seconds': elapsed,
+                     'docs_per_sec': len(ner_outputs) / max(elapsed, 1e-9)}
+            return ner_outputs, stats
+        
+        return ner_outputs
+    
+    def __call__(self, input_text):
+        return self.predict_batch([input_text])[0]
+
+
+def load_keras_model(directory='inference', buckets=None, trim=False):
+    """
+    Load h5 model saved in directory (rebuilt with variable sequence 
+    length inputs and traced once for any input shape if buckets or 
+    trim are used).
+    """
+    
+    # TensorFlow is imported only for Keras model
+    import tensorflow as tf
+    from model_tf.model_tuner import (TracedPredictModel, 
+                                      get_dynamic_length_model, 
+                                      tf_set_memory_growth)
+    
+    tf_set_memory_growth()
+    model = tf.keras.models.load_model(
+        os.path.join(directory, 'h5_model', 'model.h5'))
+    if buckets or trim:
+        model = TracedPredictModel(get_dynamic_length_model(model))
+    
+    return model
+
+
+def load_ner(directory='inference', cache_size=None, buckets=None, 
+             engine='keras', quantization=None, char_cache_words=None, 
+             trim=False, **kwargs):
+    """
+    Load preprocessor, tokenizer, labels and model saved in directory 
+    and return getPredictedNER configured with kwargs. Preprocessing 
+    files are read from vocab.json bundle (see utils.text.save_vocab_bundle)
+    if present, otherwise from joblib files. 
+    With engine='numpy' weights exported to model.npz are run by 
+    NumpyNERModel instead of h5 model, without importing TensorFlow 
+    (model_float16.npz or model_int8.npz if quantization is given).
+    With char_cache_words, character features of that many most frequent
+    words are precomputed by NumpyNERModel (numpy engine only).
+    """
+    
+    bundle_path = os.path.join(directory, 'vocab.json')
+    if os.path.exists(bundle_path):
+        text_prc, tokenizer, labels = load_vocab_bundle(bundle_path)
+    else:
+        text_prc = joblib.load(os.path.join(directory, 
+                                            'text_preprocessor.joblib'))
+        tokenizer = joblib.load(os.path.join(directory, 'tokenizer.joblib'))
+        labels = joblib.load(os.path.join(
+            directory, 'label_encoder.joblib')).classes_.tolist()
+    tokenizer.set_cache(cache_size)
+    if engine == 'numpy':
+        file_name = f'model_{quantization}.npz' if quantization \
+            else 'model.npz'
+        model = NumpyNERModel.from_npz(os.path.join(directory, file_name))
+        if char_cache_words:
+            model.set_char_cache(
+                tokenizer.get_frequent_char_ids(char_cache_words))
+    elif char_cache_words:
+        raise ValueError('Character feature cache requires numpy engine.')
+    elif quantization:
+        raise ValueError('Quantized weights require numpy engine.')
+    elif engine == 'keras':
+        model = load_keras_model(directory, buckets, trim)
+    else:
+        raise ValueError("Engine must be 'keras' or 'numpy'.")
+    
+    return getPredictedNER(text_prc, tokenizer, model, labels, 
+                           buckets=buckets, trim=trim, **kwargs)
+
+
+def add_model_arguments(parser):
+    """Add command line options configuring getPredictedNER to parser."""
+    parser.add_argument('--directory', default='inference',
+                        help='directory with model and preprocessing files')
+    parser.add_argument('--batch-size', type=int, default=64,
+                        help='number of documents per model batch')
+    parser.add_argument('--cache-size', type=int, default=None,
+                        help='number of tokens kept in tokenizer LRU cache')
+    parser.add_argument('--buckets', type=int, nargs='+', default=None,
+                        help='sequence lengths used to group documents '
+                        'into length buckets, e.g. 16 32 64')
+    parser.add_argument('--trim', action='store_true',
+                        help='trim each model batch to its longest '
+                        'sequence')
+    parser.add_argument('--windowed', action='store_true',
+                        help='tag long documents with overlapping windows '
+                        'instead of truncating them')
+    parser.add_argument('--window-overlap', type=int, default=16,
+                        help='number of tokens shared by adjacent windows')
+    parser.add_argument('--engine', choices=['keras', 'numpy'], 
+                        default='keras',
+                        help='run h5 model with TensorFlow or weights '
+                        'exported to model.npz with NumPy')
+    parser.add_argument('--quantization', choices=QUANTIZATIONS, 
+                        default=None,
+                        help='use quantized npz weights with numpy engine')
+    parser.add_argument('--char-cache', type=int, default=None,
+                        help='number of most frequent words with character '
+                        'features precomputed by numpy engine')
+    parser.add_argument('--metrics', action='store_true',
+                        help='collect per-stage timing and token counters')
+    
+    return parser
+
+
+def load_ner_from_args(args):
+    """Load getPredictedNER with options added by add_model_arguments."""
+    return load_ner(args.directory, cache_size=args.cache_size, 
+                    buckets=args.buckets, trim=args.trim, 
+                    engine=args.engine, 
+                    quantization=args.quantization, 
+                    char_cache_words=args.char_cache, 
+                    batch_size=args.batch_size, windowed=args.windowed, 
+                    window_overlap=args.window_overlap, 
+                    instrumentation=Instrumentation() if args.metrics 
+                    else None)
 
 
 if __name__ == '__main__':
     
     parser = argparse.ArgumentParser(
-        description='Process txt file with NER model.')
-    parser.add_argument('file', help='txt file for model input')
+        description='Process txt files with NER model.')
+    parser.add_argument('files', nargs='+', help='txt files for model input')
+    parser.add_argument('--stats', action='store_true',
+                        help='print throughput in documents per second')
+    add_model_arguments(parser)
     args = parser.parse_args()
-    with open (args.file) as sample_file:
-        sample = sample_file.read()
     
-    tf_set_memory_growth()
+    samples = []
+    for file in args.files:
+        with open (file) as sample_file:
+            samples.append(sample_file.read())
     
-    text_prc = joblib.load('inference/text_preprocessor.joblib')
-    tokenizer = joblib.load('inference/tokenizer.joblib')
-    model = tf.keras.models.load_model('inference/h5_model/model.h5')
-    label_encoder = joblib.load('inference/label_encoder.joblib')
-
-    get_ner = getPredictedNER(text_prc, tokenizer, model, label_encoder.classes_.tolist())
-    print(get_ner(sample))
-    
\ No newline at end of file
+    get_ner = load_ner_from_args(args)
+    ner_outputs, stats = get_ner.predict_batch(samples, return_stats=True)
+    for ner_output in ner_outputs:
+        print(ner_output)
+    
+    if args.stats:
+        print('Tagged {} documents in {:.3f}s ({:.1f} docs/sec).'.format(
+            stats['documents'], stats['seconds'], stats['docs_per_sec']))
+    
+    if get_ner.instrumentation is not None:
+        print(get_ner.instrumentation.to_prometheus(), end='')
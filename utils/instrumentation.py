@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+"""Opt-in timing and counters of inference pipeline stages."""
+
+
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+
+COUNTERS = {
+    'documents': 'Documents tagged.',
+    'tokens': 'Word tokens in documents (before truncation).',
+    'model_tokens': 'Word tokens passed to model.',
+    'truncated_tokens': 'Word tokens dropped past max_seq_len.',
+    'truncated_chars': 'Characters dropped past max_word_len.',
+    'oov_tokens': 'Word tokens passed to model mapped to OOV token.',
+    }
+
+
+class MetricsRecord:
+    """Stage wall times and counts collected during one call."""
+    enabled = True
+    
+    def __init__(self):
+        self.stages = {}
+        self.counts = dict.fromkeys(COUNTERS, 0)
+    
+    @contextmanager
+    def stage(self, name):
+        """Measure wall time of code block as given stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = (self.stages.get(name, 0.0)
+                                 + time.perf_counter() - start)
+    
+    def count(self, name, value):
+        self.counts[name] += int(value)
+    
+    def as_dict(self):
+        model_tokens = self.counts['model_tokens']
+        return {'stages': dict(self.stages), 'counts': dict(self.counts),
+                'oov_rate': (self.counts['oov_tokens'] / model_tokens
+                             if model_tokens else 0.0)}
+
+
+class _DisabledRecord:
+    """Record ignoring everything, used when instrumentation is off."""
+    enabled = False
+    _context = nullcontext()
+    
+    def stage(self, name):
+        return self._context
+    
+    def count(self, name, value):
+        pass
+
+
+DISABLED_RECORD = _DisabledRecord()
+
+
+class Instrumentation:
+    """
+    Aggregate MetricsRecord of every getPredictedNER.predict_batch call
+    into totals exportable as Prometheus text format. Optional callback
+    receives dictionary of each call metrics (see MetricsRecord.as_dict)
+    e.g., for logging slow requests.
+    """
+    
+    def __init__(self, callback=None, prefix='ner'):
+        self.callback = callback
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        """Set all totals to zero."""
+        with self._lock:
+            self.stage_seconds = {}
+            self.stage_calls = {}
+            self.counts = dict.fromkeys(COUNTERS, 0)
+    
+    def new_record(self):
+        return MetricsRecord()
+    
+    def add(self, record):
+        """Add record to totals and pass it to callback."""
+        with self._lock:
+            for name, seconds in record.stages.items():
+                self.stage_seconds[name] = (self.stage_seconds.get(name, 0.0)
+                                            + seconds)
+                self.stage_calls[name] = self.stage_calls.get(name, 0) + 1
+            for name, value in record.counts.items():
+                self.counts[name] += value
+        
+        if self.callback is not None:
+            self.callback(record.as_dict())
+    
+    def snapshot(self):
+        """Dictionary with totals of stage wall times and counts."""
+        with self._lock:
+            model_tokens = self.counts['model_tokens']
+            return {
+                'stages': {name: {'seconds': seconds,
+                                  'calls': self.stage_calls[name]}
+                           for name, seconds in self.stage_seconds.items()},
+                'counts': dict(self.counts),
+                'oov_rate': (self.counts['oov_tokens'] / model_tokens
+                             if model_tokens else 0.0)}
+    
+    def to_prometheus(self):
+        """Totals in Prometheus text exposition format."""
+        
+        snapshot = self.snapshot()
+        prefix = self.prefix
+        lines = [
+            f'# HELP {prefix}_stage_seconds_total '
+            'Wall time spent in pipeline stage.',
+            f'# TYPE {prefix}_stage_seconds_total counter']
+        lines.extend(f'{prefix}_stage_seconds_total{{stage="{name}"}} '
+                     f'{stage["seconds"]:.6f}'
+                     for name, stage in snapshot['stages'].items())
+        lines.extend([
+            f'# HELP {prefix}_stage_calls_total '
+            'Number of times pipeline stage was run.',
+            f'# TYPE {prefix}_stage_calls_total counter'])
+        lines.extend(f'{prefix}_stage_calls_total{{stage="{name}"}} '
+                     f'{stage["calls"]}'
+                     for name, stage in snapshot['stages'].items())
+        
+        for name, help_text in COUNTERS.items():
+            metric = f'{prefix}_{name}_total'
+            lines.extend([f'# HELP {metric} {help_text}',
+                          f'# TYPE {metric} counter',
+                          f'{metric} {snapshot["counts"][name]}'])
+        
+        lines.extend([
+            f'# HELP {prefix}_oov_rate '
+            'Share of model tokens mapped to OOV token.',
+            f'# TYPE {prefix}_oov_rate gauge',
+            f'{prefix}_oov_rate {snapshot["oov_rate"]:.6f}'])
+        
+        return '\n'.join(lines) + '\n'
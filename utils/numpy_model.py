@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+
+"""TensorFlow free NumPy implementation of NER model forward pass."""
+
+
+import argparse
+
+import numpy as np
+
+
+# names of arrays in npz file and (layer name, weight index) they come from
+_WEIGHTS = {
+    'word_embedding': ('word_embedding', 0),
+    'char_embedding': ('character_embedding', 0),
+    'conv_kernel': ('1d_character_convolution', 0),
+    'conv_bias': ('1d_character_convolution', 1),
+    'lstm_fw_kernel': ('bi_lstm', 0),
+    'lstm_fw_recurrent_kernel': ('bi_lstm', 1),
+    'lstm_fw_bias': ('bi_lstm', 2),
+    'lstm_bw_kernel': ('bi_lstm', 3),
+    'lstm_bw_recurrent_kernel': ('bi_lstm', 4),
+    'lstm_bw_bias': ('bi_lstm', 5),
+    'dense_kernel': ('dense', 0),
+    'dense_bias': ('dense', 1),
+    'output_kernel': ('output', 0),
+    'output_bias': ('output', 1),
+    }
+
+# embeddings are quantized per row (token), other kernels per output unit
+_ROW_QUANTIZED = ('word_embedding', 'char_embedding')
+
+QUANTIZATIONS = ('float16', 'int8')
+
+
+def quantize_weights(weights, quantization):
+    """
+    Quantize weights dictionary to float16 or to int8 with symmetric 
+    scales stored as {name}_scale arrays (biases are kept in float32).
+    """
+    
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f'Quantization must be one of {QUANTIZATIONS}.')
+    
+    if quantization == 'float16':
+        return {name: w.astype(np.float16) for name, w in weights.items()}
+    
+    quantized = {}
+    for name, w in weights.items():
+        if name.endswith('bias'):
+            quantized[name] = w
+            continue
+        axis = -1 if name in _ROW_QUANTIZED else tuple(range(w.ndim - 1))
+        scale = np.abs(w).max(axis=axis, keepdims=True) / 127
+        scale[scale == 0] = 1
+        quantized[name] = np.round(w / scale).astype(np.int8)
+        quantized[f'{name}_scale'] = scale.astype(np.float32)
+    
+    return quantized
+
+
+def export_npz(model, path, quantization=None):
+    """
+    Save weights of Keras model created by model_tf.model_tuner.build_model
+    to flat npz file that can be loaded by NumpyNERModel, optionally 
+    quantized to 'float16' or 'int8' (see quantize_weights).
+    """
+    weights = {name: model.get_layer(layer).get_weights()[i]
+               for name, (layer, i) in _WEIGHTS.items()}
+    if quantization:
+        weights = quantize_weights(weights, quantization)
+    np.savez(path, **weights)
+
+
+def _sigmoid(x):
+    return 0.5 * (np.tanh(0.5 * x) + 1)
+
+
+def _as_row_keys(array):
+    """View rows of contiguous 2D array as 1D array of opaque byte keys."""
+    return array.view(np.dtype((np.void, array.itemsize * array.shape[1]))
+                      ).ravel()
+
+
+def _softmax(x):
+    x = np.exp(x - x.max(axis=-1, keepdims=True))
+    return x / x.sum(axis=-1, keepdims=True)
+
+
+class NumpyNERModel:
+    """
+    Forward pass of NER model (word embedding, character Conv1D with max
+    pooling, BiLSTM, dense and softmax output) with weights exported by
+    export_npz (quantized weights are restored to dtype). Accepts the 
+    same [word_ids, char_ids, mask] input as Keras model padded to any 
+    sequence length and returns the same probabilities (up to float 
+    rounding), so that it can replace Keras model in
+    utils.inference.getPredictedNER without importing TensorFlow.
+    """
+    
+    def __init__(self, weights, dtype='float32'):
+        self.weights = {}
+        for name in _WEIGHTS:
+            w = np.asarray(weights[name], dtype=dtype)
+            if f'{name}_scale' in weights:
+                w *= weights[f'{name}_scale']
+            self.weights[name] = w
+        self.dtype = dtype
+        self.lstm_units = self.weights['lstm_fw_recurrent_kernel'].shape[0]
+        self._char_cache = None
+        self._char_table = None
+    
+    @classmethod
+    def from_npz(cls, path, **kwargs):
+        """Load model from npz file saved by export_npz."""
+        with np.load(path) as weights:
+            return cls(weights, **kwargs)
+    
+    def _compute_char_features(self, char_ids):
+        """
+        Max pooled character convolution features for each word given by 
+        (..., max_word_len) character ids.
+        """
+        w = self.weights
+        kernel = w['conv_kernel']
+        kernel_size = kernel.shape[0]
+        
+        # 'same' padding puts extra padding position on the right side
+        char_emb = w['char_embedding'][char_ids]
+        pad_left = (kernel_size - 1) // 2
+        pad_right = kernel_size - 1 - pad_left
+        char_emb = np.pad(char_emb, [(0, 0)] * (char_emb.ndim - 2) + 
+                          [(pad_left, pad_right), (0, 0)])
+        
+        n_chars = char_ids.shape[-1]
+        conv = w['conv_bias'] + sum(
+            char_emb[..., k:k + n_chars, :] @ kernel[k]
+            for k in range(kernel_size))
+        
+        return np.tanh(conv).max(axis=-2)
+    
+    def set_char_cache(self, char_ids):
+        """
+        Precompute character features of words given by (n_words, 
+        max_word_len) character ids, e.g. frequent words from 
+        CustomTokenizer.get_frequent_char_ids, so that convolution runs 
+        only for other words (None disables the cache).
+        """
+        
+        self._char_cache, self._char_table = None, None
+        if char_ids is None:
+            return self
+        
+        char_ids = np.ascontiguousarray(char_ids, dtype=np.int32)
+        self._char_table = self._compute_char_features(char_ids)
+        self._char_cache = {key.tobytes(): i for i, key 
+                            in enumerate(_as_row_keys(char_ids))}
+        
+        return self
+    
+    def _char_features(self, char_ids, word_mask):
+        """
+        Character features of words in (batch, time, max_word_len) char
+        ids. With cache set, features of each distinct word under 
+        word_mask are taken from cache or computed once, while masked 
+        steps (ignored by LSTM) are left as zeros.
+        """
+        
+        if self._char_cache is None:
+            return self._compute_char_features(char_ids)
+        
+        features = np.zeros(char_ids.shape[:2] + self._char_table.shape[1:],
+                            dtype=self.dtype)
+        rows = np.ascontiguousarray(char_ids[word_mask], dtype=np.int32)
+        if not len(rows):
+            return features
+        
+        keys, inverse = np.unique(_as_row_keys(rows), return_inverse=True)
+        slots = np.fromiter((self._char_cache.get(key.tobytes(), -1) 
+                             for key in keys), dtype=np.int64, count=len(keys))
+        
+        hits = slots >= 0
+        key_features = np.empty((len(keys),) + self._char_table.shape[1:],
+                                dtype=self.dtype)
+        key_features[hits] = self._char_table[slots[hits]]
+        if not hits.all():
+            key_rows = keys.view(np.int32).reshape(len(keys), -1)
+            key_features[~hits] = self._compute_char_features(
+                key_rows[~hits])
+        features[word_mask] = key_features[inverse.ravel()]
+        
+        return features
+    
+    def _lstm(self, inputs, mask, direction):
+        """
+        Run LSTM over (batch, time, features) inputs, skipping masked
+        steps (with zero output) as Keras does.
+        """
+        w = self.weights
+        kernel = w[f'lstm_{direction}_kernel']
+        recurrent_kernel = w[f'lstm_{direction}_recurrent_kernel']
+        units = self.lstm_units
+        
+        batch_size, n_steps = mask.shape
+        x_proj = inputs @ kernel + w[f'lstm_{direction}_bias']
+        h = np.zeros((batch_size, units), dtype=self.dtype)
+        c = np.zeros((batch_size, units), dtype=self.dtype)
+        outputs = np.zeros((batch_size, n_steps, units), dtype=self.dtype)
+        
+        steps = range(n_steps) if direction == 'fw' else reversed(
+            range(n_steps))
+        for t in steps:
+            z = x_proj[:, t] + h @ recurrent_kernel
+            i = _sigmoid(z[:, :units])
+            f = _sigmoid(z[:, units:2 * units])
+            g = np.tanh(z[:, 2 * units:3 * units])
+            o = _sigmoid(z[:, 3 * units:])
+            c_new = f * c + i * g
+            h_new = o * np.tanh(c_new)
+            
+            step_mask = mask[:, t, None]
+            c = np.where(step_mask, c_new, c)
+            h = np.where(step_mask, h_new, h)
+            outputs[:, t] = np.where(step_mask, h_new, 0)
+        
+        return outputs
+    
+    def predict_on_batch(self, X):
+        """Predict label probabilities for [word_ids, char_ids, mask]."""
+        word_ids, char_ids = np.asarray(X[0]), np.asarray(X[1])
+        w = self.weights
+        
+        output = np.zeros(word_ids.shape + w['output_bias'].shape,
+                          dtype=self.dtype)
+        
+        # steps after the last word are masked in every row, so that
+        # recurrent loop runs only up to the longest sequence in batch
+        word_mask = word_ids != 0
+        n_steps = word_mask.any(axis=0).nonzero()[0]
+        n_steps = n_steps[-1] + 1 if len(n_steps) else 0
+        word_ids, char_ids = word_ids[:, :n_steps], char_ids[:, :n_steps]
+        word_mask = word_mask[:, :n_steps]
+        
+        features = np.concatenate([w['word_embedding'][word_ids],
+                                   self._char_features(char_ids, word_mask)], 
+                                  axis=-1)
+        lstm = np.concatenate([self._lstm(features, word_mask, 'fw'),
+                               self._lstm(features, word_mask, 'bw')],
+                              axis=-1)
+        dense = np.maximum(lstm @ w['dense_kernel'] + w['dense_bias'], 0)
+        output[:, :n_steps] = _softmax(dense @ w['output_kernel']
+                                       + w['output_bias'])
+        
+        # masked steps have zero LSTM output, as in Keras
+        output[:, n_steps:] = _softmax(
+            np.maximum(w['dense_bias'], 0) @ w['output_kernel']
+            + w['output_bias'])
+        
+        return output
+    
+    def predict(self, X, batch_size=64):
+        """Predict label probabilities in batches of batch_size rows."""
+        return np.concatenate([
+            self.predict_on_batch([x[i:i + batch_size] for x in X])
+            for i in range(0, len(X[0]), batch_size)])
+
+
+if __name__ == '__main__':
+    
+    # convert h5 model to npz file for TensorFlow free inference
+    
+    parser = argparse.ArgumentParser(
+        description='Export h5 NER model weights to npz file.')
+    parser.add_argument('--model', default='inference/h5_model/model.h5',
+                        help='path to h5 model')
+    parser.add_argument('--output', default='inference/model.npz',
+                        help='path to output npz file')
+    parser.add_argument('--quantization', choices=QUANTIZATIONS, 
+                        default=None, help='quantize exported weights')
+    args = parser.parse_args()
+    
+    import tensorflow as tf
+    
+    export_npz(tf.keras.models.load_model(args.model), args.output, 
+               args.quantization)
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+"""Streaming tf.data input pipelines for training and evaluation."""
+
+
+import hashlib
+import json
+import os
+from itertools import islice
+
+import numpy as np
+import tensorflow as tf
+
+from utils.text import iter_txt_file
+
+
+def make_dataset(path, tokenizer, label_encoder, batch_size=64, 
+                 shuffle_buffer=None, num_parallel_calls=tf.data.experimental.AUTOTUNE):
+    """
+    Create dataset streaming sentences from CoNLL txt file at path and 
+    yielding batches of ((word_ids, char_ids, mask), labels, labels_mask)
+    ready for Keras fit / evaluate / predict. Sentences are read lazily 
+    and tokenized, padded and encoded per batch in parallel map calls 
+    with prefetching, so memory stays flat regardless of corpus size.
+    Tokenizer has to be fitted with character level tokenization and
+    label_encoder should be a fitted SequentialLabelEncoder. Batches are
+    encoded concurrently, hence tokenizer cache should not be set.
+    """
+    
+    def generate_sentences():
+        for words, tags in iter_txt_file(path):
+            yield ' '.join(words), ' '.join(tags)
+    
+    def encode_batch(sentences, labels):
+        sentences = [s.decode('utf-8').split(' ') for s in sentences]
+        labels = [l.decode('utf-8').split(' ') for l in labels]
+        word_ids, char_ids, mask = tokenizer.transform(sentences)
+        y, y_mask = label_encoder.transform(labels)
+        return word_ids, char_ids, mask, y, y_mask
+    
+    def encode(sentences, labels):
+        word_ids, char_ids, mask, y, y_mask = tf.numpy_function(
+            encode_batch, [sentences, labels], 
+            [tf.int32, tf.int32, tf.int32, tf.int32, tf.int32])
+        word_ids.set_shape([None, tokenizer.max_seq_len])
+        char_ids.set_shape([None, tokenizer.max_seq_len, 
+                            tokenizer.max_word_len])
+        mask.set_shape([None, tokenizer.max_seq_len])
+        y.set_shape([None, label_encoder.max_seq_len])
+        y_mask.set_shape([None, label_encoder.max_seq_len])
+        return (word_ids, char_ids, mask), y, y_mask
+    
+    dataset = tf.data.Dataset.from_generator(
+        generate_sentences, output_types=(tf.string, tf.string),
+        output_shapes=((), ()))
+    if shuffle_buffer:
+        dataset = dataset.shuffle(shuffle_buffer)
+    
+    return (dataset
+            .batch(batch_size)
+            .map(encode, num_parallel_calls=num_parallel_calls)
+            .prefetch(tf.data.experimental.AUTOTUNE))
+
+
+_ARRAY_NAMES = ('word_ids', 'char_ids', 'mask', 'labels', 'labels_mask')
+
+
+def save_split_arrays(directory, data):
+    """
+    Save arrays of {split: (X, y, y_mask)} dictionary (e.g., loaded from
+    data/data.joblib) as npy files in directory.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for split, (X, y, y_mask) in data.items():
+        for name, array in zip(_ARRAY_NAMES, list(X) + [y, y_mask]):
+            np.save(os.path.join(directory, f'{split}_{name}.npy'), array)
+
+
+def load_split_arrays(directory, splits=('train', 'valid', 'test'), 
+                      mmap_mode='r'):
+    """
+    Load {split: (X, y, y_mask)} arrays saved by save_split_arrays, 
+    memory mapped by default so that processes share the same pages.
+    """
+    data = {}
+    for split in splits:
+        arrays = [np.load(os.path.join(directory, f'{split}_{name}.npy'), 
+                          mmap_mode=mmap_mode) for name in _ARRAY_NAMES]
+        data[split] = (arrays[:3], arrays[3], arrays[4])
+    return data
+
+
+_SPLIT_PATHS = {'train': 'PATH_TRAIN', 'valid': 'PATH_VALID', 
+                'test': 'PATH_TEST'}
+
+
+def _get_hash(state):
+    """Hash of json serializable state."""
+    return hashlib.sha256(
+        json.dumps(state, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def get_encoders_hash(tokenizer, label_encoder):
+    """
+    Hash of fitted tokenizer vocabularies and settings along with classes 
+    of label_encoder (fitted SequentialLabelEncoder).
+    """
+    
+    state = {
+        'word_index': tokenizer.word_tokenizer.word_index,
+        'char_index': (tokenizer.char_tokenizer.word_index 
+                       if tokenizer.char_level else None),
+        'settings': [tokenizer.max_seq_len, tokenizer.max_word_len, 
+                     tokenizer.lower, tokenizer.filters, tokenizer.oov_token],
+        'labels': label_encoder.le.classes_.tolist(),
+        'label_settings': [label_encoder.max_seq_len, 
+                           label_encoder.pad_value],
+        }
+    
+    return _get_hash(state)
+
+
+def get_split_key(conf, split, encoders_hash):
+    """
+    Cache key of split arrays: hash of config entries (except paths of 
+    other splits), size and modification time of split CoNLL file and 
+    hash of encoders.
+    """
+    
+    path = conf[_SPLIT_PATHS[split]]
+    stat = os.stat(path)
+    state = {
+        'config': {key: value for key, value in conf.items() 
+                   if key not in _SPLIT_PATHS.values()},
+        'path': path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+        'encoders': encoders_hash,
+        }
+    
+    return _get_hash(state)
+
+
+def _write_split_arrays(directory, split, path, tokenizer, label_encoder,
+                        chunk_size=4096, dtype='int32'):
+    """
+    Encode sentences of CoNLL file at path in chunks of chunk_size 
+    straight into npy files of split arrays (named as by save_split_arrays)
+    and return number of sentences. Files are written under temporary 
+    names and renamed once complete.
+    """
+    
+    n_rows = sum(1 for _ in iter_txt_file(path))
+    shapes = [(tokenizer.max_seq_len,), 
+              (tokenizer.max_seq_len, tokenizer.max_word_len), 
+              (tokenizer.max_seq_len,), (label_encoder.max_seq_len,), 
+              (label_encoder.max_seq_len,)]
+    paths = [os.path.join(directory, f'{split}_{name}.npy') 
+             for name in _ARRAY_NAMES]
+    arrays = [np.lib.format.open_memmap(
+        array_path + '.tmp', mode='w+', dtype=dtype, shape=(n_rows,) + shape)
+        for array_path, shape in zip(paths, shapes)]
+    
+    sentences = iter_txt_file(path)
+    for start in range(0, n_rows, chunk_size):
+        words, tags = zip(*islice(sentences, chunk_size))
+        X = tokenizer.transform(list(words), dtype=dtype)
+        y, y_mask = label_encoder.transform(tags, dtype=dtype)
+        for array, values in zip(arrays, list(X) + [y, y_mask]):
+            array[start:start + len(values)] = values
+    
+    for array in arrays:
+        array.flush()
+    del arrays
+    for array_path in paths:
+        os.replace(array_path + '.tmp', array_path)
+    
+    return n_rows
+
+
+def build_dataset_cache(directory, conf, tokenizer, label_encoder, 
+                        splits=('train', 'valid', 'test'), chunk_size=4096):
+    """
+    Build cache of {split}_{name}.npy arrays encoded from CoNLL files given
+    in conf (loaded config.json) with fitted tokenizer and label_encoder 
+    (fitted SequentialLabelEncoder), to be loaded with load_split_arrays.
+    Key of each split (see get_split_key) is stored in manifest.json and 
+    only splits with changed key or missing files are rebuilt. Return 
+    manifest dictionary.
+    """
+    
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, 'manifest.json')
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+    
+    encoders_hash = get_encoders_hash(tokenizer, label_encoder)
+    for split in splits:
+        key = get_split_key(conf, split, encoders_hash)
+        if manifest.get(split, {}).get('key') == key and all(
+                os.path.exists(os.path.join(directory, f'{split}_{name}.npy'))
+                for name in _ARRAY_NAMES):
+            continue
+        
+        path = conf[_SPLIT_PATHS[split]]
+        n_rows = _write_split_arrays(directory, split, path, tokenizer, 
+                                     label_encoder, chunk_size)
+        manifest[split] = {'key': key, 'path': path, 'rows': n_rows}
+        
+        with open(manifest_path + '.tmp', 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=4)
+        os.replace(manifest_path + '.tmp', manifest_path)
+    
+    return manifest
+
+
+def make_array_dataset(data, batch_size=64, shuffle=False, 
+                       num_parallel_calls=tf.data.experimental.AUTOTUNE):
+    """
+    Create dataset of ((word_ids, char_ids, mask), labels, labels_mask) 
+    batches gathered from (X, y, y_mask) arrays. Rows are read per batch,
+    so memory mapped arrays are used in place instead of being copied 
+    into tensors as Keras does for numpy inputs.
+    """
+    
+    X, y, y_mask = data
+    arrays = list(X) + [y, y_mask]
+    
+    def gather_rows(indices):
+        indices = np.sort(indices)
+        return [np.asarray(array[indices]) for array in arrays]
+    
+    def get_batch(indices):
+        batch = tf.numpy_function(
+            gather_rows, [indices], 
+            [tf.as_dtype(array.dtype) for array in arrays])
+        for tensor, array in zip(batch, arrays):
+            tensor.set_shape((None,) + array.shape[1:])
+        return tuple(batch[:len(X)]), batch[-2], batch[-1]
+    
+    dataset = tf.data.Dataset.range(len(y))
+    if shuffle:
+        dataset = dataset.shuffle(len(y), reshuffle_each_iteration=True)
+    
+    return (dataset
+            .batch(batch_size)
+            .map(get_batch, num_parallel_calls=num_parallel_calls)
+            .prefetch(tf.data.experimental.AUTOTUNE))
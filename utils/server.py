@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+
+"""HTTP service for NER model with dynamic micro-batching."""
+
+
+import argparse
+import json
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from utils.inference import add_model_arguments, load_ner_from_args
+
+
+@dataclass
+class _Request:
+    """Texts submitted together with future for their results."""
+    texts: list
+    future: Future = field(default_factory=Future)
+    enqueued: float = field(default_factory=time.perf_counter)
+
+
+class MicroBatcher:
+    """
+    Collect texts submitted concurrently into micro-batches processed by
+    a single worker thread. A batch is closed when it reaches
+    max_batch_size texts or max_wait seconds after its first request.
+    """
+    
+    def __init__(self, predict_batch, max_batch_size=64, max_wait=0.005,
+                 stats_window=10000):
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        
+        self._queue = queue.Queue()
+        self._latencies = deque(maxlen=stats_window)
+        self._batch_sizes = deque(maxlen=stats_window)
+        self._requests = 0
+        self._batches = 0
+        self._lock = threading.Lock()
+        
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+    
+    def submit(self, texts):
+        """Submit list of texts and return future with list of outputs."""
+        request = _Request(list(texts))
+        self._queue.put(request)
+        return request.future
+    
+    def close(self):
+        """Stop worker thread after pending requests are processed."""
+        self._queue.put(None)
+        self._worker.join()
+    
+    def _collect_batch(self, first):
+        """Collect requests following the first one until batch is full."""
+        batch, n_texts = [first], len(first.texts)
+        deadline = time.perf_counter() + self.max_wait
+        
+        while n_texts < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                self._queue.put(None)
+                break
+            batch.append(request)
+            n_texts += len(request.texts)
+        
+        return batch
+    
+    def _run(self):
+        """Process micro-batches until closed."""
+        while True:
+            request = self._queue.get()
+            if request is None:
+                return
+            
+            # requests cancelled while queued are dropped, the others 
+            # can no longer be cancelled
+            batch = [request for request in self._collect_batch(request)
+                     if request.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            texts = [text for request in batch for text in request.texts]
+            try:
+                outputs = self.predict_batch(texts)
+            except Exception as exc:
+                for request in batch:
+                    request.future.set_exception(exc)
+                continue
+            
+            done = time.perf_counter()
+            start = 0
+            for request in batch:
+                end = start + len(request.texts)
+                request.future.set_result(outputs[start:end])
+                start = end
+            
+            with self._lock:
+                self._requests += len(batch)
+                self._batches += 1
+                self._batch_sizes.append(len(texts))
+                self._latencies.extend(done - request.enqueued
+                                       for request in batch)
+    
+    def stats(self):
+        """Latency percentiles (in ms) and batch size statistics."""
+        with self._lock:
+            latencies = np.array(self._latencies) * 1000
+            batch_sizes = np.array(self._batch_sizes)
+            stats = {'requests': self._requests, 'batches': self._batches,
+                     'queued': self._queue.qsize()}
+        
+        if len(latencies):
+            stats['latency_ms'] = {
+                'p50': float(np.percentile(latencies, 50)),
+                'p99': float(np.percentile(latencies, 99)),
+                'max': float(latencies.max())}
+            stats['batch_size'] = {
+                'mean': float(batch_sizes.mean()),
+                'p50': float(np.percentile(batch_sizes, 50)),
+                'max': int(batch_sizes.max())}
+        
+        return stats
+
+
+class NERRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handle POST /predict with {"text": str} or {"texts": [str, ...]}
+    JSON body, GET /stats and GET /metrics (Prometheus text format, if 
+    model instrumentation is enabled) requests.
+    """
+    
+    def _send_json(self, status, content):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def do_GET(self):
+        instrumentation = self.server.instrumentation
+        if self.path == '/stats':
+            self._send_json(200, self.server.batcher.stats())
+        elif self.path == '/metrics' and instrumentation is not None:
+            body = instrumentation.to_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 
+                             'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json(404, {'error': 'Not found.'})
+    
+    def do_POST(self):
+        if self.path != '/predict':
+            self._send_json(404, {'error': 'Not found.'})
+            return
+        
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            content = json.loads(self.rfile.read(length))
+            if not isinstance(content, dict):
+                raise TypeError
+            single = 'text' in content
+            texts = [content['text']] if single else content['texts']
+            if not (isinstance(texts, list) and
+                    all(isinstance(text, str) for text in texts)):
+                raise TypeError
+        except (ValueError, KeyError, TypeError):
+            self._send_json(400, {'error': 'JSON with "text" string or '
+                                  '"texts" list of strings required.'})
+            return
+        
+        future = self.server.batcher.submit(texts)
+        try:
+            outputs = future.result(timeout=self.server.request_timeout)
+        except FutureTimeoutError:
+            # texts still queued are dropped by worker thread
+            future.cancel()
+            self._send_json(504, {'error': 'Request timed out after '
+                                  f'{self.server.request_timeout}s.'})
+            return
+        except Exception as exc:
+            self._send_json(500, {'error': repr(exc)})
+            return
+        
+        self._send_json(200, {'ner': outputs[0] if single else outputs})
+    
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class NERServer(ThreadingHTTPServer):
+    """Threading HTTP server with backlog sized for concurrent clients."""
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def make_server(get_ner, host='127.0.0.1', port=8000, max_batch_size=64,
+                max_wait=0.005, request_timeout=30.0, verbose=False):
+    """Create threading HTTP server tagging texts with get_ner."""
+    
+    server = NERServer((host, port), NERRequestHandler)
+    server.batcher = MicroBatcher(get_ner.predict_batch, max_batch_size,
+                                  max_wait)
+    server.request_timeout = request_timeout
+    server.instrumentation = get_ner.instrumentation
+    server.verbose = verbose
+    
+    return server
+
+
+if __name__ == '__main__':
+    
+    parser = argparse.ArgumentParser(
+        description='Serve NER model over HTTP with micro-batching.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max-batch-size', type=int, default=64,
+                        help='maximum number of texts per micro-batch')
+    parser.add_argument('--max-wait-ms', type=float, default=5.0,
+                        help='maximum time to wait for micro-batch to fill')
+    parser.add_argument('--verbose', action='store_true',
+                        help='log every request')
+    add_model_arguments(parser)
+    args = parser.parse_args()
+    
+    get_ner = load_ner_from_args(args)
+    get_ner('Warm up .')
+    
+    server = make_server(get_ner, args.host, args.port, args.max_batch_size,
+                         args.max_wait_ms / 1000, verbose=args.verbose)
+    print('Serving NER model on http://{}:{}.'.format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.batcher.close()
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+
+"""Tagging of document collections in parallel processes."""
+
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+
+from threadpoolctl import threadpool_limits
+
+from utils.batching import iter_chunks
+from utils.inference import add_model_arguments, load_ner_from_args
+
+
+FORMATS = ('jsonl', 'conll')
+
+_THREAD_VARIABLES = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                     'MKL_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS')
+
+# model loaded once per worker process by init_worker
+_worker_ner = None
+
+
+def iter_documents(paths):
+    """
+    Yield (id, text) of documents from paths in order: each txt file in
+    a directory (sorted, id is relative path), each line of a jsonl file
+    with 'text' and optionally 'id' fields (id is file:line by default)
+    or any other file as a single document.
+    """
+    
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(
+                os.path.join(root, name)
+                for root, _, names in os.walk(path)
+                for name in names if name.endswith('.txt'))
+            for file in files:
+                with open(file, encoding='utf-8') as txt_file:
+                    yield os.path.relpath(file, path), txt_file.read()
+        elif path.endswith('.jsonl'):
+            with open(path, encoding='utf-8') as jsonl_file:
+                for i, line in enumerate(jsonl_file, 1):
+                    if line.strip():
+                        document = json.loads(line)
+                        yield (document.get('id', f'{path}:{i}'),
+                               document['text'])
+        else:
+            with open(path, encoding='utf-8') as txt_file:
+                yield path, txt_file.read()
+
+
+def format_documents(ids, ner_outputs, output_format):
+    """
+    Format tagged documents as jsonl lines with id, tokens and tags or as
+    CoNLL 'token tag' lines with documents separated by '-DOCSTART- id'
+    lines.
+    """
+    
+    lines = []
+    for doc_id, ner_output in zip(ids, ner_outputs):
+        if output_format == 'jsonl':
+            tokens, tags = (list(seq) for seq in zip(*ner_output)) \
+                if ner_output else ([], [])
+            lines.append(json.dumps({'id': doc_id, 'tokens': tokens,
+                                     'tags': tags}, ensure_ascii=False))
+        else:
+            lines.append(f'-DOCSTART- {doc_id}\n')
+            lines.extend(f'{token} {tag}' for token, tag in ner_output)
+            lines.append('')
+    
+    return '\n'.join(lines) + '\n'
+
+
+def get_shard_path(directory, shard, output_format):
+    """Path of output file of shard with given index."""
+    return os.path.join(directory, f'shard-{shard:05d}.{output_format}')
+
+
+def get_shard_key(documents):
+    """Hash of ids and texts of documents in shard (in order)."""
+    return hashlib.sha256(json.dumps(
+        documents, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def is_shard_done(directory, shard, output_format, documents):
+    """
+    Check if shard file written by previous run exists. Raise error if it
+    was tagged from other documents, e.g., because input files were added,
+    removed or edited since then and documents moved between shards.
+    """
+    
+    path = get_shard_path(directory, shard, output_format)
+    if not os.path.exists(path):
+        return False
+    
+    key = None
+    if os.path.exists(path + '.sha256'):
+        with open(path + '.sha256') as key_file:
+            key = key_file.read().strip()
+    if key != get_shard_key(documents):
+        raise ValueError(
+            f'{path} was tagged from different documents, inputs changed '
+            'since previous run.')
+    
+    return True
+
+
+def init_worker(args):
+    """
+    Load model once per worker process, limiting BLAS / OpenMP threads
+    with threadpoolctl (environment variables set by command line entry
+    point take effect only in spawned workers, as numpy is already 
+    imported in the main process) and TensorFlow intra-op threads for 
+    Keras engine.
+    """
+    
+    global _worker_ner
+    
+    threadpool_limits(args.threads)
+    if args.engine == 'keras':
+        from model_tf.model_tuner import tf_set_threads
+        tf_set_threads(args.threads)
+    
+    _worker_ner = load_ner_from_args(args)
+
+
+def tag_shard(shard, documents, directory, output_format):
+    """
+    Tag documents of shard with model loaded by init_worker and write them
+    to shard file, created under temporary name and renamed once complete.
+    Hash of shard documents (see get_shard_key) is written before, so that
+    resumed run can check them. Return shard index with numbers of 
+    documents and tokens.
+    """
+    
+    ids, texts = zip(*documents)
+    ner_outputs = _worker_ner.predict_batch(texts)
+    
+    path = get_shard_path(directory, shard, output_format)
+    with open(path + '.tmp', 'w', encoding='utf-8') as shard_file:
+        shard_file.write(format_documents(ids, ner_outputs, output_format))
+    with open(path + '.sha256.tmp', 'w') as key_file:
+        key_file.write(get_shard_key(documents))
+    os.replace(path + '.sha256.tmp', path + '.sha256')
+    os.replace(path + '.tmp', path)
+    
+    return shard, len(ids), sum(len(output) for output in ner_outputs)
+
+
+def get_model_settings(args):
+    """
+    Model and inference options of args that change tags, saved with run
+    settings so that shards tagged by different models are not mixed.
+    """
+    return {'directory': os.path.abspath(args.directory),
+            'engine': args.engine, 'quantization': args.quantization,
+            'windowed': args.windowed, 'window_overlap': args.window_overlap,
+            'buckets': args.buckets, 'trim': args.trim}
+
+
+def check_run_settings(directory, settings):
+    """
+    Save settings determining shard contents in directory or, if already
+    saved by previous run, check that they are the same, so that shards
+    written before can be skipped.
+    """
+    
+    path = os.path.join(directory, 'tagging.json')
+    if os.path.exists(path):
+        with open(path) as settings_file:
+            if json.load(settings_file) != settings:
+                raise ValueError(
+                    f'{directory} contains shards of run with different '
+                    'inputs, shard size, format or model settings.')
+    else:
+        with open(path, 'w') as settings_file:
+            json.dump(settings, settings_file, indent=4)
+
+
+def tag_corpus(args):
+    """
+    Tag documents from args.inputs in shards of args.shard_size documents
+    fanned out over args.workers processes (or tagged in this process if
+    there is one worker) and return statistics. Shards already present in
+    args.output are skipped if they hold the same documents (error is 
+    raised otherwise) and at most two shards per worker are pending at 
+    once, so that documents are streamed from inputs.
+    """
+    
+    os.makedirs(args.output, exist_ok=True)
+    check_run_settings(args.output, {
+        'inputs': [os.path.abspath(path) for path in args.inputs],
+        'shard_size': args.shard_size, 'format': args.format,
+        'model': get_model_settings(args)})
+    
+    shards = (
+        (shard, documents) for shard, documents
+        in enumerate(iter_chunks(iter_documents(args.inputs),
+                                 args.shard_size))
+        if not is_shard_done(args.output, shard, args.format, documents))
+    
+    stats = {'shards': 0, 'documents': 0, 'tokens': 0}
+    
+    def add_stats(result):
+        _, documents, tokens = result
+        stats['shards'] += 1
+        stats['documents'] += documents
+        stats['tokens'] += tokens
+    
+    start = time.perf_counter()
+    if args.workers == 1:
+        init_worker(args)
+        for shard, documents in shards:
+            add_stats(tag_shard(shard, documents, args.output, args.format))
+    else:
+        # TensorFlow is not fork safe, hence workers are spawned
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(args.workers, init_worker, (args,)) as pool:
+            pending = deque()
+            for shard, documents in shards:
+                pending.append(pool.apply_async(
+                    tag_shard, (shard, documents, args.output, args.format)))
+                if len(pending) >= 2 * args.workers:
+                    add_stats(pending.popleft().get())
+            while pending:
+                add_stats(pending.popleft().get())
+    
+    stats['seconds'] = time.perf_counter() - start
+    stats['docs_per_sec'] = stats['documents'] / max(stats['seconds'], 1e-9)
+    
+    return stats
+
+
+if __name__ == '__main__':
+    
+    parser = argparse.ArgumentParser(
+        description='Tag directories of txt files or jsonl files of '
+        'documents into sharded output.')
+    parser.add_argument('inputs', nargs='+',
+                        help='directories with txt files, jsonl files with '
+                        'text field or txt files')
+    parser.add_argument('--output', required=True,
+                        help='directory for shard files')
+    parser.add_argument('--format', choices=FORMATS, default='jsonl')
+    parser.add_argument('--shard-size', type=int, default=1000,
+                        help='number of documents per shard file')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='number of worker processes')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='intra-op threads per worker (CPU count divided '
+                        'by number of workers by default)')
+    add_model_arguments(parser)
+    args = parser.parse_args()
+    
+    args.threads = args.threads or max(
+        1, (os.cpu_count() or 1) // args.workers)
+    # inherited by spawned workers before they import numpy, thread pools
+    # of this process are limited by init_worker
+    for variable in _THREAD_VARIABLES:
+        os.environ[variable] = str(args.threads)
+    
+    print(json.dumps(tag_corpus(args), indent=4))
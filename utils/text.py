@@ -4,32 +4,65 @@
 
 
 import json
+import os
 import re
+from collections import OrderedDict
+from itertools import repeat
 
 import numpy as np
-import tensorflow as tf
 
 
-def read_txt_file(path):
-    """Read txt file with tagged lines."""
-    sentences, labels = [], []
+_NON_SPACE_WHITESPACE = re.compile(r'[^\S ]')
+
+# whitespace character (so that it never matches \S) other than space and 
+# newline, which appear in TextPreprocessor patterns
+_BATCH_SEPARATOR = '\x1f'
+
+DEFAULT_PUNCTUATION = '!"#$%&()*+,-./:;<=>?@[\\]^_`{|}~'
+
+
+def iter_txt_file(path):
+    """
+    Lazily read txt file with tagged lines yielding (words, tags) tuple 
+    for each sentence.
+    """
     with open(path) as infile:
         words, tags = [], []
         for line in infile:
             if line != '\n':
-                if line == '-DOCSTART- -X- -X- O\n':
+                if line.startswith('-DOCSTART-'):
                     continue
                 else:
                     line = line.rstrip().split()
                     words.append(line[0])
                     tags.append(line[-1])
             elif bool(words):
-                sentences.append(words)
-                labels.append(tags)
+                yield words, tags
                 words, tags = [], []
+
+
+def read_txt_file(path):
+    """Read txt file with tagged lines."""
+    sentences, labels = [], []
+    for words, tags in iter_txt_file(path):
+        sentences.append(words)
+        labels.append(tags)
     return sentences, labels
 
 
+def get_ragged_positions(lengths):
+    """
+    Row and column indices of all elements of a ragged batch given 
+    the length of each row, e.g. [2, 1] -> ([0, 0, 1], [0, 1, 0]).
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    cols = np.arange(len(rows)) - offsets
+    
+    return rows, cols
+
+
 def write_js_from_dict(path, dictionary, const_name='constname'):
     """Write python dictionary to specified js file."""
     with open(path, 'w') as f:
@@ -68,28 +101,76 @@ def create_eval_file(path, tokenized_sentences, labels_per_sentece,
             write_file.write('\n')
 
 
-def get_glove_embedding_matrix(glove_file_path, word_index_dict, 
-                               dtype='float32'):
+def convert_glove_embeddings(glove_file_path, output_prefix=None, 
+                             dtype='float32'):
     """
-    Import glove embeddings from file to python dictionary and create
-    embedding matrix according to word indices in word_index_dict.
+    Convert glove embeddings txt file to binary npy matrix (to be memory 
+    mapped on load) and vocab file listing words in order of matrix rows.
+    Files are written as output_prefix + '.npy' / '.vocab' with glove 
+    file path without extension used by default. Conversion streams the
+    txt file twice and never holds all embeddings in memory. Files are 
+    written under temporary names and renamed once complete (npy file 
+    last), so that interrupted conversion does not leave truncated files.
     """
     
-    glove_embeddings = {}
-    with open (glove_file_path, 'r', encoding="utf-8") as glove_file:
+    output_prefix = output_prefix or os.path.splitext(glove_file_path)[0]
+    vectors_path, vocab_path = output_prefix + '.npy', output_prefix + '.vocab'
+    
+    n_rows, dim = 0, 0
+    with open(glove_file_path, 'r', encoding='utf-8') as glove_file:
         for line in glove_file:
+            dim = dim or len(line.split()) - 1
+            n_rows += 1
+    
+    vectors = np.lib.format.open_memmap(
+        vectors_path + '.tmp', mode='w+', dtype=dtype, shape=(n_rows, dim))
+    with open(glove_file_path, 'r', encoding='utf-8') as glove_file, \
+            open(vocab_path + '.tmp', 'w', encoding='utf-8') as vocab:
+        for row, line in enumerate(glove_file):
             values = line.split()
-            word = values[0]
-            vector = np.asarray(values[1:], dtype=dtype)
-            glove_embeddings[word] = vector
+            vectors[row] = np.asarray(values[1:], dtype=dtype)
+            vocab.write(values[0] + '\n')
+    vectors.flush()
+    del vectors
+    
+    os.replace(vocab_path + '.tmp', vocab_path)
+    os.replace(vectors_path + '.tmp', vectors_path)
+    
+    return output_prefix
+
+
+def get_glove_embedding_matrix(glove_file_path, word_index_dict, 
+                               dtype='float32'):
+    """
+    Import glove embeddings and create embedding matrix according to word 
+    indices in word_index_dict. Embeddings are read from binary files 
+    created by convert_glove_embeddings next to the txt file (converted
+    first if missing or outdated), memory mapped and gathered only for 
+    words in word_index_dict.
+    """
+    
+    prefix = os.path.splitext(glove_file_path)[0]
+    vectors_path, vocab_path = prefix + '.npy', prefix + '.vocab'
+    if (not os.path.exists(vectors_path) or not os.path.exists(vocab_path)
+            or os.path.exists(glove_file_path) and 
+            os.path.getmtime(glove_file_path) > os.path.getmtime(vectors_path)):
+        convert_glove_embeddings(glove_file_path, prefix, dtype)
+    
+    vectors = np.load(vectors_path, mmap_mode='r')
+    
+    glove_rows = {}
+    with open(vocab_path, 'r', encoding='utf-8') as vocab:
+        for row, line in enumerate(vocab):
+            word = line.rstrip('\n')
+            if word in word_index_dict:
+                glove_rows[word] = row
     
     embedding_matrix = np.random.random(
-        (len(word_index_dict), len(vector))
+        (len(word_index_dict), vectors.shape[1])
         ).astype(dtype)
     
-    for wrd, idx in word_index_dict.items():
-        if wrd in glove_embeddings.keys():
-            embedding_matrix[idx] = glove_embeddings[wrd]
+    indices = [word_index_dict[wrd] for wrd in glove_rows]
+    embedding_matrix[indices] = vectors[list(glove_rows.values())]
     
     return embedding_matrix
             
@@ -98,56 +179,299 @@ class TextPreprocessor:
     """Class for preprocessing text input."""
     
     def __init__(self, separate_apostrophes=True, separate_punctuation=True,
-                 punctuation='!"#$%&()*+,-./:;<=>?@[\\]^_`{|}~'):
+                 punctuation=DEFAULT_PUNCTUATION):
         self.separate_apostrophes = separate_apostrophes
         self.separate_punctuation = separate_punctuation
         self.punctuation = punctuation
+        self._compile_patterns()
+    
+    def _compile_patterns(self):
+        """
+        Compile regular expressions for current punctuation. Batch variants
+        treat _BATCH_SEPARATOR as end of text, so that texts joined with it
+        are processed as if separately.
+        """
+        
+        eos = (self.punctuation + " ")
+        batch_end = r'(?=\n?(?:{}|\Z))'.format(_BATCH_SEPARATOR)
+        
+        apostrophes = r"(?i)([a-z])('|'s|'ll|'m|'re|'ve|'d|n't)([{}]|{})"
+        self._apostrophe_pattern = re.compile(
+            apostrophes.format(eos, '$'))
+        self._batch_apostrophe_pattern = re.compile(
+            apostrophes.format(eos, batch_end))
+        
+        self._punctuation_patterns = (
+            re.compile(r"(?i)(\S)([{}])".format(self.punctuation)),
+            re.compile(r"(?i)([{}])(\S)".format(self.punctuation)))
+        
+        fused = (r"(?i)('(?<=[a-z]')(?:s|ll|m|re|ve|d)?|n(?<=[a-z]n)'t)"
+                 r"(?=[{0}]|{1})|([{2}]+)")
+        self._fused_pattern = re.compile(
+            fused.format(eos, '$', self.punctuation))
+        self._batch_fused_pattern = re.compile(
+            fused.format(eos, batch_end, self.punctuation))
+        
+        self._compiled_punctuation = self.punctuation
+    
+    def _check_patterns(self):
+        """Compile patterns if missing (e.g., unpickled instance) or stale."""
+        if getattr(self, '_compiled_punctuation', None) != self.punctuation:
+            self._compile_patterns()
     
-    def _get_apostrophes_separated(self, text):
+    def _has_fused_path(self):
+        """Check if all steps can be run as single fused substitution."""
+        return (self.separate_apostrophes and self.separate_punctuation and
+                self.punctuation == DEFAULT_PUNCTUATION)
+    
+    def _get_apostrophes_separated(self, text, batch=False):
         """
         Insert space before apostrophes indicating possession or 
         used in contractions, e.g. Peter's -> Peter 's or I'm -> I 'm.
         """
-        eos = (self.punctuation + " ")
-        text = re.sub(r"(?i)([a-z])('|'s|'ll|'m|'re|'ve|'d|n't)([{}]|$)"
-                      .format(eos), r"\1 \2\3", text)
+        self._check_patterns()
+        pattern = (self._batch_apostrophe_pattern if batch 
+                   else self._apostrophe_pattern)
         
-        return text
+        return pattern.sub(r"\1 \2\3", text)
     
     def _get_punctuation_separated(self, text):
         """Separate punctuation from other text."""
-        text = re.sub(r"(?i)(\S)([{}])".format(self.punctuation), 
-                      r"\1 \2", text)
-        text = re.sub(r"(?i)([{}])(\S)".format(self.punctuation), 
-                      r"\1 \2", text)
+        self._check_patterns()
+        for pattern in self._punctuation_patterns:
+            text = pattern.sub(r"\1 \2", text)
         
         return text
     
-    def __call__(self, text):
-        """Apply preprocessing steps."""
+    @staticmethod
+    def _get_fused_replacement(match):
+        """
+        Replacement for match of fused pattern giving the same result as 
+        apostrophe and both punctuation substitutions run in turn. Run of 
+        punctuation is always separated from preceding text and its 
+        characters from each other, but as matches of the substitutions 
+        do not overlap, it is separated from following text only if it 
+        is of odd length and follows other text, or it starts a word and 
+        is of even length or single character.
+        """
+        
+        run = match.group(2)
+        if run is None:
+            return ' ' + match.group(1)
+        
+        text, start, end = match.string, match.start(), match.end()
+        inner = start > 0 and not text[start - 1].isspace()
+        separated = ' '.join(run)
+        
+        if end < len(text) and not text[end].isspace():
+            if (len(run) % 2 if inner 
+                    else len(run) == 1 or not len(run) % 2):
+                separated += ' '
+        
+        if inner:
+            separated = ' ' + separated
+        
+        return separated
+    
+    def _preprocess(self, text, batch=False):
+        """
+        Apply preprocessing steps to single text (or texts joined with 
+        _BATCH_SEPARATOR if batch is True).
+        """
+        
+        if self._has_fused_path():
+            self._check_patterns()
+            pattern = (self._batch_fused_pattern if batch 
+                       else self._fused_pattern)
+            return pattern.sub(self._get_fused_replacement, text)
+        
+        if self.separate_apostrophes:
+            text = self._get_apostrophes_separated(text, batch)
+        
+        if self.separate_punctuation:
+            text = self._get_punctuation_separated(text)
+        
+        return text
+    
+    def _preprocess_reference(self, text):
+        """Apply preprocessing steps with uncompiled patterns one by one."""
+        
+        if self.separate_apostrophes:
+            eos = (self.punctuation + " ")
+            text = re.sub(r"(?i)([a-z])('|'s|'ll|'m|'re|'ve|'d|n't)([{}]|$)"
+                          .format(eos), r"\1 \2\3", text)
+        
+        if self.separate_punctuation:
+            text = re.sub(r"(?i)(\S)([{}])".format(self.punctuation), 
+                          r"\1 \2", text)
+            text = re.sub(r"(?i)([{}])(\S)".format(self.punctuation), 
+                          r"\1 \2", text)
+        
+        return text
+    
+    def preprocess_batch(self, texts):
+        """
+        Apply preprocessing steps to list of texts. Texts are joined into 
+        one string, so that patterns are run once for the whole batch 
+        (texts containing the separator are processed one by one).
+        """
+        
+        if not texts:
+            return []
+        
+        joined = _BATCH_SEPARATOR.join(texts)
+        if joined.count(_BATCH_SEPARATOR) != len(texts) - 1:
+            return [self._preprocess(text) for text in texts]
+        
+        return self._preprocess(joined, batch=True).split(_BATCH_SEPARATOR)
+    
+    def to_dict(self):
+        """Settings as json serializable dictionary."""
+        return {'separate_apostrophes': self.separate_apostrophes,
+                'separate_punctuation': self.separate_punctuation,
+                'punctuation': self.punctuation}
+    
+    @classmethod
+    def from_dict(cls, state):
+        """Create preprocessor from dictionary created by to_dict."""
+        return cls(**state)
+    
+    def __call__(self, text, fast=True):
+        """
+        Apply preprocessing steps. By default compiled patterns are used
+        (fused into single substitution for default settings), whereas 
+        fast=False runs the original substitutions one by one (reference 
+        implementation).
+        """
         
-        return_string = False
         msg = 'String or list of strings required as input.'
         
         if isinstance(text, list):
             if not all([isinstance(t, str) for t in text]):
                 raise TypeError(msg)
+            if not fast:
+                return [self._preprocess_reference(t) for t in text]
+            return self.preprocess_batch(text)
         elif isinstance(text, str):
-            return_string = True
-            text = [text]
-        else:
-            raise TypeError(msg)
+            if not fast:
+                return self._preprocess_reference(text)
+            return self._preprocess(text)
         
-        if self.separate_apostrophes:
-            text = [self._get_apostrophes_separated(t) for t in text]
+        raise TypeError(msg)
+
+
+class TokenCache:
+    """
+    Bounded cache of word id and padded character ids row per token 
+    with least recently used eviction.
+    """
+    
+    def __init__(self, maxsize, max_word_len):
+        if maxsize < 1:
+            raise ValueError('Cache size must be a positive integer.')
         
-        if self.separate_punctuation:
-            text = [self._get_punctuation_separated(t) for t in text]
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.word_ids = np.zeros(maxsize, dtype=np.int64)
+        self.char_ids = np.zeros((maxsize, max_word_len), dtype=np.int64)
+        self._slots = OrderedDict()
+    
+    def __len__(self):
+        return len(self._slots)
+    
+    def lookup(self, tokens, n_lookups=None):
+        """
+        Find distinct tokens in cache and mark them as recently used. 
+        Return positions and slots of cached tokens along with positions 
+        of missing tokens. n_lookups is the number of occurrences of 
+        tokens in batch (len(tokens) by default): all occurrences except 
+        the first one of each missing token are counted as hits.
+        """
         
-        if return_string:
-            return text[0]
-            
-        return text
+        slots = np.fromiter(map(self._slots.get, tokens, repeat(-1)),
+                            dtype=np.int64, count=len(tokens))
+        hit_positions = np.flatnonzero(slots >= 0)
+        miss_positions = np.flatnonzero(slots < 0)
+        
+        mark_used = self._slots.move_to_end
+        for i in hit_positions.tolist():
+            mark_used(tokens[i])
+        
+        n_lookups = len(tokens) if n_lookups is None else n_lookups
+        self.hits += n_lookups - len(miss_positions)
+        self.misses += len(miss_positions)
+        
+        return hit_positions, slots[hit_positions], miss_positions
+    
+    def update(self, tokens, word_ids, char_ids):
+        """Insert new tokens evicting least recently used ones if full."""
+        
+        tokens = tokens[-self.maxsize:]
+        slots = []
+        for token in tokens:
+            if len(self._slots) < self.maxsize:
+                slot = len(self._slots)
+            else:
+                _, slot = self._slots.popitem(last=False)
+            self._slots[token] = slot
+            slots.append(slot)
+        
+        self.word_ids[slots] = word_ids[-self.maxsize:]
+        self.char_ids[slots] = char_ids[-self.maxsize:]
+    
+    def clear(self):
+        """Remove all tokens and reset counters."""
+        self._slots.clear()
+        self.hits = 0
+        self.misses = 0
+    
+    def info(self):
+        """Cache statistics."""
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 
+                'size': len(self), 'maxsize': self.maxsize,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+
+
+class Vocabulary:
+    """
+    Fitted vocabulary with settings of Keras Tokenizer used for transform 
+    by CustomTokenizer, without word counts and TensorFlow import.
+    """
+    
+    def __init__(self, word_index, oov_token, lower, char_level, 
+                 filters='', split=' '):
+        self.word_index = word_index
+        self.oov_token = oov_token
+        self.lower = lower
+        self.char_level = char_level
+        self.filters = filters
+        self.split = split
+        self.num_words = None
+    
+    @classmethod
+    def from_tokenizer(cls, tokenizer):
+        """Create vocabulary from fitted Keras Tokenizer."""
+        if tokenizer.num_words is not None:
+            raise ValueError('Tokenizers with num_words are not supported.')
+        
+        return cls(dict(tokenizer.word_index), tokenizer.oov_token, 
+                   tokenizer.lower, tokenizer.char_level, tokenizer.filters, 
+                   tokenizer.split)
+    
+    def to_keras(self):
+        """Keras Tokenizer with the same vocabulary and settings."""
+        import tensorflow as tf
+        
+        tokenizer = tf.keras.preprocessing.text.Tokenizer(
+            filters=self.filters, lower=self.lower, split=self.split, 
+            char_level=self.char_level, oov_token=self.oov_token)
+        tokenizer.word_index = dict(self.word_index)
+        tokenizer.index_word = {idx: word for word, idx 
+                                in self.word_index.items()}
+        
+        return tokenizer
 
 
 class CustomTokenizer:
@@ -164,6 +488,11 @@ class CustomTokenizer:
         self.filters = filters
         self.lower = lower
         self._fitted = False
+        self.cache = None
+        
+        # TensorFlow is imported only where Keras tokenizers are needed, 
+        # so that transforming with fitted vocabularies does not load it
+        import tensorflow as tf
         
         self.word_tokenizer = tf.keras.preprocessing.text.Tokenizer(
             filters=filters, lower=lower, char_level=False, 
@@ -174,11 +503,68 @@ class CustomTokenizer:
                 filters=filters, lower=False, char_level=True, 
                 oov_token=oov_token)
     
+    def set_cache(self, cache_size):
+        """
+        Serve word and character ids of tokens from LRU cache holding 
+        at most cache_size tokens (None disables the cache).
+        """
+        
+        self._check_if_fitted()
+        
+        self.cache = None
+        if cache_size and self.char_level:
+            self.cache = TokenCache(cache_size, self.max_word_len)
+        
+        return self
+    
     def _check_if_fitted(self):
         """Raise error if tokenizer is not fitted."""
         if not self._fitted:
             raise AttributeError('CustomTokenizer not fitted yet.')
     
+    def to_dict(self):
+        """Settings and vocabularies as json serializable dictionary."""
+        
+        self._check_if_fitted()
+        
+        return {
+            'char_level': self.char_level, 'oov_token': self.oov_token,
+            'pad_token': self.pad_token, 'filters': self.filters,
+            'lower': self.lower, 'split': self.word_tokenizer.split,
+            'max_seq_len': self.max_seq_len, 
+            'max_word_len': self.max_word_len,
+            'word_index': dict(self.word_tokenizer.word_index),
+            'char_index': (dict(self.char_tokenizer.word_index) 
+                           if self.char_level else None),
+            }
+    
+    @classmethod
+    def from_dict(cls, state):
+        """
+        Create fitted tokenizer from dictionary created by to_dict without
+        importing TensorFlow. Keras tokenizers are replaced with 
+        Vocabulary objects, hence it can be used for transform only.
+        """
+        
+        tokenizer = cls.__new__(cls)
+        for name in ['char_level', 'oov_token', 'pad_token', 'filters', 
+                     'lower', 'max_seq_len', 'max_word_len']:
+            setattr(tokenizer, name, state[name])
+        
+        tokenizer.word_tokenizer = Vocabulary(
+            state['word_index'], tokenizer.oov_token, tokenizer.lower, 
+            False, tokenizer.filters, state['split'])
+        if tokenizer.char_level:
+            tokenizer.char_tokenizer = Vocabulary(
+                state['char_index'], tokenizer.oov_token, False, True, 
+                tokenizer.filters, state['split'])
+        
+        tokenizer.cache = None
+        tokenizer._char_lookup = None
+        tokenizer._fitted = True
+        
+        return tokenizer
+    
     def fit(self, texts, max_seq_len=32, max_word_len=16):
         """Fit tokenizers on texts."""
         
@@ -192,12 +578,19 @@ class CustomTokenizer:
             self.char_tokenizer.fit_on_texts(texts)
             self.char_tokenizer.word_index[self.pad_token] = 0
             
+        self._char_lookup = None
         self._fitted = True
+        
+        if getattr(self, 'cache', None) is not None:
+            self.set_cache(self.cache.maxsize)
 
         return self
     
-    def get_original_tokens(self, text):
-        """Retrieve original word level tokens (e.g., before lowering)."""
+    def get_original_tokens(self, text, truncate=True):
+        """
+        Retrieve original word level tokens (e.g., before lowering).
+        Tokens past max_seq_len are dropped unless truncate is False.
+        """
         
         if not isinstance(text, str):
             raise TypeError('String type input required.')
@@ -207,13 +600,211 @@ class CustomTokenizer:
         if bool(self.filters):
             text = re.sub(f'[{self.filters}]', ' ', text)
         
-        return text.split()[:self.max_seq_len]
+        if truncate:
+            return text.split()[:self.max_seq_len]
+        
+        return text.split()
+    
+    def _has_fast_path(self):
+        """Check if vocabularies can be compiled into lookup tables."""
+        tokenizers = [self.word_tokenizer]
+        if self.char_level:
+            tokenizers.append(self.char_tokenizer)
+        
+        return all(tkn.num_words is None and 
+                   tkn.word_index.get(tkn.oov_token) is not None 
+                   for tkn in tokenizers)
+    
+    def _get_char_lookup(self):
+        """
+        Array mapping unicode code points to character ids, with the last
+        element holding the id of out of vocabulary characters.
+        """
+        
+        if getattr(self, '_char_lookup', None) is None:
+            char_index = self.char_tokenizer.word_index
+            chars = {ord(char): idx for char, idx in char_index.items() 
+                     if len(char) == 1}
+            lookup = np.full(max(chars, default=0) + 2, 
+                             char_index[self.oov_token], dtype=np.int64)
+            lookup[list(chars)] = list(chars.values())
+            self._char_lookup = lookup
+        
+        return self._char_lookup
+    
+    def _get_word_sequences(self, texts):
+        """Split texts into tokens the same way as word_tokenizer does."""
+        sequences = []
+        for text in texts:
+            if isinstance(text, list):
+                seq = [w.lower() for w in text] if self.lower else text
+            else:
+                split = self.word_tokenizer.split
+                if self.lower:
+                    text = text.lower()
+                text = text.translate(
+                    str.maketrans({c: split for c in self.filters}))
+                seq = [w for w in text.split(split) if w]
+            sequences.append(seq[:self.max_seq_len])
+        
+        return sequences
+    
+    def _get_char_sequences(self, texts):
+        """Split texts into tokens fed to char_tokenizer."""
+        sequences = []
+        for text in texts:
+            if not isinstance(text, list):
+                if bool(self.filters):
+                    text = re.sub(f'[{self.filters}]', ' ', text)
+                text = text.split()
+            sequences.append(text[:self.max_seq_len])
+        
+        return sequences
+    
+    def _lookup_words(self, words, dtype):
+        """Word ids for flat list of (already lowered) words."""
+        word_index = self.word_tokenizer.word_index
+        oov_id = word_index[self.oov_token]
+        
+        return np.fromiter((word_index.get(w, oov_id) for w in words), 
+                           dtype=dtype, count=len(words))
+    
+    def _encode_chars(self, tokens, dtype):
+        """
+        Padded character ids of shape (len(tokens), max_word_len) gathered 
+        from code point lookup table for all tokens at once.
+        """
+        
+        tokens = [t[:self.max_word_len] for t in tokens]
+        code_points = np.frombuffer(
+            ''.join(tokens).encode('utf-32-le', 'surrogatepass'), 
+            dtype='<u4')
+        char_lookup = self._get_char_lookup()
+        
+        char_ids = np.zeros((len(tokens), self.max_word_len), dtype)
+        char_ids[get_ragged_positions([len(t) for t in tokens])] = \
+            char_lookup[np.minimum(code_points, len(char_lookup) - 1)]
+        
+        return char_ids
+    
+    def _encode_cached(self, tokens, dtype):
+        """
+        Word ids and padded character ids of tokens served from cache, 
+        with missing tokens encoded once per distinct token and cached.
+        """
+        
+        distinct = list(dict.fromkeys(tokens))
+        index = dict(zip(distinct, range(len(distinct))))
+        inverse = np.fromiter(map(index.__getitem__, tokens), 
+                              dtype=np.int64, count=len(tokens))
+        hit_positions, hit_slots, miss_positions = self.cache.lookup(
+            distinct, len(tokens))
+        
+        word_ids = np.zeros(len(distinct), dtype)
+        char_ids = np.zeros((len(distinct), self.max_word_len), dtype)
+        word_ids[hit_positions] = self.cache.word_ids[hit_slots]
+        char_ids[hit_positions] = self.cache.char_ids[hit_slots]
+        
+        if len(miss_positions):
+            new_tokens = [distinct[i] for i in miss_positions.tolist()]
+            new_word_ids = self._lookup_words(
+                [t.lower() for t in new_tokens] if self.lower else new_tokens,
+                dtype)
+            new_char_ids = self._encode_chars(new_tokens, dtype)
+            word_ids[miss_positions] = new_word_ids
+            char_ids[miss_positions] = new_char_ids
+            self.cache.update(new_tokens, new_word_ids, new_char_ids)
+        
+        return word_ids[inverse], char_ids[inverse]
+    
+    def get_frequent_char_ids(self, n_words, dtype='int32'):
+        """
+        Padded character ids of n_words most frequent vocabulary words 
+        (word index is ordered by frequency) in lower case, capitalized 
+        and upper case form.
+        """
+        
+        self._check_if_fitted()
+        
+        word_index = self.word_tokenizer.word_index
+        special_tokens = {self.oov_token, self.pad_token}
+        words = [word for word in sorted(word_index, key=word_index.get) 
+                 if word not in special_tokens][:n_words]
+        forms = dict.fromkeys(form for word in words 
+                              for form in (word, word.capitalize(), 
+                                           word.upper()))
+        
+        return self._encode_chars(list(forms), dtype)
+    
+    def _is_split_aligned(self, texts):
+        """
+        Check if word_tokenizer splits texts into the same tokens as 
+        character level tokenization (up to lowering).
+        """
+        return (self.word_tokenizer.split == ' ' and 
+                self.filters == self.filters.lower() and
+                not any(isinstance(t, str) and _NON_SPACE_WHITESPACE.search(t)
+                        for t in texts))
+    
+    def _transform_fast(self, texts, dtype):
+        """
+        Vectorized equivalent of transform based on compiled vocabularies:
+        word ids are looked up once per token and character ids for the 
+        whole batch are gathered from code point lookup table into one
+        preallocated array. Word ids and character ids of tokens are 
+        served from cache if it is set.
+        """
+        
+        word_ids = None
+        
+        if self.char_level:
+            char_sequences = self._get_char_sequences(texts)
+            tokens = [t for seq in char_sequences for t in seq]
+            positions = get_ragged_positions([len(seq) 
+                                              for seq in char_sequences])
+            if getattr(self, 'cache', None) is not None:
+                word_ids, char_ids = self._encode_cached(tokens, dtype)
+            else:
+                char_ids = self._encode_chars(tokens, dtype)
+            
+            tokenized_char_ids = np.zeros(
+                (len(texts), self.max_seq_len, self.max_word_len), dtype)
+            tokenized_char_ids[positions] = char_ids
+        
+        if word_ids is None or not self._is_split_aligned(texts):
+            word_sequences = self._get_word_sequences(texts)
+            positions = get_ragged_positions([len(seq) 
+                                              for seq in word_sequences])
+            word_ids = self._lookup_words(
+                [w for seq in word_sequences for w in seq], dtype)
+        
+        tokenized_word_ids = np.zeros((len(texts), self.max_seq_len), dtype)
+        tokenized_word_ids[positions] = word_ids
+        input_mask = (tokenized_word_ids != 0).astype(dtype)
+        
+        if self.char_level:
+            return tokenized_word_ids, tokenized_char_ids, input_mask
+        
+        return tokenized_word_ids, input_mask
     
-    def transform(self, texts, dtype='int32'):
+    def _get_keras_tokenizers(self):
+        """
+        Word and character level (or None) Keras tokenizers, converted 
+        from vocabularies if tokenizer was created with from_dict.
+        """
+        tokenizers = [self.word_tokenizer, 
+                      self.char_tokenizer if self.char_level else None]
+        
+        return [tkn.to_keras() if isinstance(tkn, Vocabulary) else tkn 
+                for tkn in tokenizers]
+    
+    def transform(self, texts, dtype='int32', fast=True):
         """
         Transform texts with fitted tokenizers and pad.
         List of texts, list of lists of texts or standalone text 
         is acceptable as input.
+        By default vocabularies compiled to lookup tables are used, whereas
+        fast=False runs the Keras tokenizers (reference implementation).
         """
         
         self._check_if_fitted()
@@ -221,7 +812,13 @@ class CustomTokenizer:
         if isinstance(texts, str):
             texts = [texts]
         
-        tokenized_word_ids = self.word_tokenizer.texts_to_sequences(texts)
+        if fast and self._has_fast_path():
+            return self._transform_fast(texts, dtype)
+        
+        import tensorflow as tf
+        
+        word_tokenizer, char_tokenizer = self._get_keras_tokenizers()
+        tokenized_word_ids = word_tokenizer.texts_to_sequences(texts)
         tokenized_word_ids = tf.keras.preprocessing.sequence.pad_sequences(
             tokenized_word_ids, maxlen=self.max_seq_len, padding='post', 
             truncating='post').astype(dtype)
@@ -241,7 +838,7 @@ class CustomTokenizer:
                 )
             
             tokenized_char_ids = [
-                self.char_tokenizer.texts_to_sequences(text)
+                char_tokenizer.texts_to_sequences(text)
                 for text in empty_padded_texts
                 ]
             
@@ -256,3 +853,76 @@ class CustomTokenizer:
             return tokenized_word_ids, tokenized_char_ids, input_mask
         
         return tokenized_word_ids, input_mask
+
+
+def save_vocab_bundle(path, preprocessor, tokenizer, labels):
+    """
+    Save preprocessor settings, fitted tokenizer vocabularies and labels 
+    (ordered by label id, e.g. label_encoder.classes_) as one json file 
+    which is loaded with load_vocab_bundle without TensorFlow.
+    """
+    
+    bundle = {'preprocessor': preprocessor.to_dict(), 
+              'tokenizer': tokenizer.to_dict(), 
+              'labels': list(labels)}
+    with open(path, 'w', encoding='utf-8') as bundle_file:
+        json.dump(bundle, bundle_file, ensure_ascii=False, 
+                  separators=(',', ':'))
+
+
+def load_vocab_bundle(path):
+    """
+    Load TextPreprocessor, CustomTokenizer (transform only) and list of 
+    labels saved with save_vocab_bundle.
+    """
+    
+    with open(path, encoding='utf-8') as bundle_file:
+        bundle = json.load(bundle_file)
+    
+    return (TextPreprocessor.from_dict(bundle['preprocessor']),
+            CustomTokenizer.from_dict(bundle['tokenizer']), 
+            bundle['labels'])
+
+
+def write_web_app_vocabs(directory, tokenizer, labels):
+    """Write word and character vocabularies and labels as web app js."""
+    
+    write_js_from_dict(os.path.join(directory, 'wordVocab.js'), 
+                       tokenizer.word_tokenizer.word_index, 
+                       const_name='wordVocab')
+    write_js_from_dict(os.path.join(directory, 'charVocab.js'), 
+                       tokenizer.char_tokenizer.word_index, 
+                       const_name='charVocab')
+    write_js_from_dict(os.path.join(directory, 'labels.js'), 
+                       dict(enumerate(labels)), const_name='labels')
+
+
+if __name__ == '__main__':
+    
+    import argparse
+    
+    import joblib
+    
+    parser = argparse.ArgumentParser(
+        description='Convert joblib preprocessing files to vocab bundle.')
+    parser.add_argument('--directory', default='inference',
+                        help='directory with text_preprocessor.joblib, '
+                        'tokenizer.joblib and label_encoder.joblib')
+    parser.add_argument('--output', default=None,
+                        help='bundle path (vocab.json in directory by '
+                        'default)')
+    parser.add_argument('--web-app-vocabs', default=None,
+                        help='also write js vocabularies to this directory, '
+                        'e.g. web-app/vocabs')
+    args = parser.parse_args()
+    
+    text_prc = joblib.load(os.path.join(args.directory, 
+                                        'text_preprocessor.joblib'))
+    tokenizer = joblib.load(os.path.join(args.directory, 'tokenizer.joblib'))
+    labels = joblib.load(os.path.join(args.directory, 
+                                      'label_encoder.joblib')).classes_.tolist()
+    
+    output = args.output or os.path.join(args.directory, 'vocab.json')
+    save_vocab_bundle(output, text_prc, tokenizer, labels)
+    if args.web_app_vocabs:
+        write_web_app_vocabs(args.web_app_vocabs, tokenizer, labels)